@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Stand-in for the Docker Engine API on a unix socket, backed by the state of the docker shim.
+
+Only the control operations used by the action are served: listing, killing, removing and waiting for containers,
+sending signals to their processes with exec, and inspecting and removing images. The containers are run by the docker
+shim.'''
+
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+POLLING_PERIOD = 0.05
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # persistent connections, as the Docker Engine
+
+    def do_GET(self):
+        path, query = self._parse()
+        if path == '/_ping':
+            self._send(200, 'OK')
+        elif path == '/containers/json':
+            labels = json.loads(query.get('filters', '{}')).get('label', [])
+            containers = []
+            for name in os.listdir(self.server.containers_directory):
+                container = self.server.load_container(name, query.get('all') == '1')
+                if container is not None and all(label in container['labels'] for label in labels):
+                    containers.append({'Id': name, 'Names': [f'/{name}'], 'Labels': container['labels']})
+            self._send(200, containers)
+        elif path.startswith('/images/') and path.endswith('/json'):
+            image = self.server.image_path(path[len('/images/'):-len('/json')])
+            if not os.path.exists(image):
+                self._send(404, {'message': 'No such image'})
+                return
+            with open(image) as f:
+                self._send(200, {'Size': int(f.read())})
+        else:
+            self._send(404, {'message': f'Unsupported: GET {path}'})
+
+    def do_POST(self):
+        path, _ = self._parse()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        parts = path.split('/')
+        if len(parts) != 4:
+            self._send(404, {'message': f'Unsupported: POST {path}'})
+        elif parts[1] == 'containers' and parts[3] == 'kill':
+            self._signal(parts[2], signal.SIGTERM)  # the shim exits on SIGTERM
+        elif parts[1] == 'containers' and parts[3] == 'exec':
+            if self.server.load_container(parts[2]) is None:
+                self._send(409, {'message': f'Container {parts[2]} is not running'})
+                return
+            with self.server.lock:
+                self.server.execs.append((parts[2], json.loads(body)['Cmd']))
+                self._send(201, {'Id': str(len(self.server.execs) - 1)})
+        elif parts[1] == 'containers' and parts[3] == 'wait':  # condition=removed, as the containers are run with --rm
+            if self.server.load_container(parts[2], True) is None:
+                self._send(404, {'message': f'No such container: {parts[2]}'})
+                return
+            while self.server.load_container(parts[2], True) is not None:
+                time.sleep(POLLING_PERIOD)
+            self._send(200, {'StatusCode': self.server.exit_code(parts[2])})
+        elif parts[1] == 'exec' and parts[3] == 'start':
+            container, command = self.server.execs[int(parts[2])]
+            if command[0] != 'pkill':
+                self._send(500, {'message': 'Only pkill is supported by exec'})
+                return
+            self._signal(container, signal.SIGINT, command[-1])
+        else:
+            self._send(404, {'message': f'Unsupported: POST {path}'})
+
+    def do_DELETE(self):
+        path, _ = self._parse()
+        if path.startswith('/containers/'):
+            name = path.split('/')[2]
+            container = self.server.load_container(name, True)
+            if container is not None and container['pid'] is None:  # created but never started
+                os.remove(os.path.join(self.server.containers_directory, name))
+            self._signal(name, signal.SIGTERM)
+        elif path.startswith('/images/'):
+            image = self.server.image_path(path[len('/images/'):])
+            if os.path.exists(image):
+                os.remove(image)
+            self._send(200, [])
+        else:
+            self._send(404, {'message': f'Unsupported: DELETE {path}'})
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse(self):
+        url = urllib.parse.urlsplit(self.path)
+        return urllib.parse.unquote(url.path), dict(urllib.parse.parse_qsl(url.query))
+
+    def _signal(self, name, signum, process=None):
+        container = self.server.load_container(name)
+        if container is None:
+            self._send(404, {'message': f'No such container: {name}'})
+            return
+        # the Webots process of a warm container is the one started by docker exec, as in the docker shim
+        pid = container.get('webots') if process == 'webots-bin' and 'options' in container else container['pid']
+        try:
+            if pid is not None:
+                os.kill(pid, signum)
+        except ProcessLookupError:  # the Webots instance already quit
+            pass
+        self._send(204)
+
+    def _send(self, status, content=None):
+        body = json.dumps(content).encode('utf-8') if content is not None else b''
+        self.send_response(status)
+        if content is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DockerEngine(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, state):
+        super().__init__(socket_path, _Handler)
+        self.containers_directory = os.path.join(state, 'containers')
+        self.images_directory = os.path.join(state, 'images')
+        self.exits_directory = os.path.join(state, 'exits')
+        os.makedirs(self.containers_directory, exist_ok=True)
+        os.makedirs(self.images_directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.execs = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def load_container(self, name, created=False):  # as the docker shim
+        try:
+            with open(os.path.join(self.containers_directory, name)) as f:
+                container = json.load(f)
+            if container['pid'] is None:
+                return container if created else None
+            os.kill(container['pid'], 0)
+        except (OSError, ValueError):
+            return None
+        return container
+
+    def exit_code(self, name):  # written by the docker shim before removing the container
+        try:
+            with open(os.path.join(self.exits_directory, name)) as f:
+                return json.load(f) or 0
+        except (OSError, ValueError):
+            return 0  # created but never started
+
+    def image_path(self, tag):
+        return os.path.join(self.images_directory, tag.replace('/', '_').replace(':', '_'))
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        os.remove(self.server_address)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Benchmark of the orchestration overhead of the action, run without Docker, GitHub nor webots.cloud.
+
+The docker and git executables are replaced by the shims of the `shims` directory and webots.cloud by a local HTTP
+server, then the action is run on synthetic leagues and the timing report of each run is summarized.'''
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import yaml
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from docker_engine import DockerEngine
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHIMS_DIRECTORY = os.path.join(ROOT_DIRECTORY, 'benchmark', 'shims')
+REPOSITORY = 'benchmark/competition'
+SCENARIOS = {
+    'league-10': {'participants': 10},
+    'league-100': {'participants': 100, 'world': {'ranking-search': 'binary'}},
+    'league-1000': {'participants': 1000, 'world': {'ranking-search': 'binary'}},
+    'chatty-controllers': {'participants': 10, 'controller-lines': 100000},
+    'huge-animation': {'participants': 4, 'animation-size': 200 * 1024 * 1024},
+    # the second run only changes participant.json
+    'resubmission': {'participants': 10, 'runs': 2, 'update-description': True},
+    # the second run changes the world and its participant.json, so the participant is evaluated again
+    'world-update': {'participants': 10, 'runs': 2, 'update-description': True, 'update-world': True},
+    # the first run is killed during the climb, the second one resumes it
+    'interrupted-climb': {'participants': 30, 'runs': 2, 'interrupt': 8},
+    'crashing-participant': {'participants': 10, 'crash': 'participant', 'game-time': 30},
+    # the participant of a performance evaluation exits with code 0 long before the world reports its performance
+    'exiting-participant': {'participants': 10, 'exit': 'participant', 'game-time': 8, 'check-performance': True,
+                            'world': {'metric': 'time', 'higher-is-better': False}},
+    'rating': {'participants': 10, 'world': {'metric': 'rating'}},  # games against all the participants
+    # webots.cloud is down during the first run, which keeps its journal, and each upload of the second run fails once
+    'flaky-upload': {'participants': 10, 'runs': 2, 'upload-failures': ['always', 'once']},
+    # the Webots instance of the slot is reset for each opponent of the climb
+    'warm-webots': {'participants': 10, 'world': {'warm-webots': True}},
+    # a performance evaluation aggregated over 4 concurrent runs
+    'multi-seed': {'participants': 10, 'game-time': 1, 'world': {'metric': 'time', 'higher-is-better': False,
+                                                                 'seeds': [1, 2, 3, 4], 'aggregation': 'median'}},
+}
+MAX_PARSED_UPLOAD_SIZE = 16 * 1024 * 1024
+WORLD = '''#VRML_SIM R2023b utf8
+WorldInfo {
+  basicTimeStep 32
+}
+Robot {
+  name "participant"
+  controller "participant"
+}
+Robot {
+  name "opponent"
+  controller "opponent"
+}
+'''
+
+
+class _WebotsCloud(BaseHTTPRequestHandler):
+    '''Stand-in for webots.cloud serving participants.json and accepting the uploads, which update it.
+
+    With the 'always' failure mode, every upload fails with a 503 error. With 'once', the first upload of each file
+    fails, alternately with a 503 error and by dropping the connection without a response.'''
+
+    def do_GET(self):
+        if self.path != f'/storage/competition/{REPOSITORY}/participants.json':
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.participants).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        body = self.rfile.read(min(remaining, MAX_PARSED_UPLOAD_SIZE))  # the animations are not kept
+        remaining -= len(body)
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        path = _get_multipart_file(body, self.headers['Content-Type'], 'path')  # the first field of the form
+        with self.server.lock:
+            mode = self.server.failure_mode
+            failed = mode == 'always' or mode == 'once' and path not in self.server.failed
+            if failed:
+                self.server.failed.add(path)
+                self.server.failures += 1
+            dropped = mode == 'once' and self.server.failures % 2 == 0
+        if failed and dropped:
+            self.close_connection = True
+            return
+        if failed:
+            self.send_error(503)
+            return
+        if remaining == 0 and len(body) < MAX_PARSED_UPLOAD_SIZE:
+            participants = _get_multipart_file(body, self.headers['Content-Type'], 'participants')
+            if participants is not None:
+                self.server.participants = json.loads(participants)
+        with self.server.lock:
+            self.server.uploads += 1
+            self.server.uploaded += int(self.headers['Content-Length'])
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'OK')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_scenario(name, scenario, world_overrides, game_time, cache_directory, keep, docker_cli=False):
+    '''Run the action once or several times on a league, each run using the participants.json of the previous one.'''
+
+    directory = tempfile.mkdtemp(prefix=f'benchmark-{name}-')
+    game_time = scenario.get('game-time', game_time)
+    state = os.path.join(directory, 'state')
+    home = os.path.join(directory, 'home')
+    for path in [state, home]:
+        os.makedirs(path)
+    world = {'file': 'worlds/benchmark.wbt', 'metric': 'ranking', 'higher-is-better': True, 'max-duration': 180}
+    world.update(scenario.get('world', {}))
+    world.update(world_overrides)
+
+    count = scenario['participants']
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _WebotsCloud)
+    server.participants = {'participants': [
+        {'id': f'p{i}', 'repository': f'benchmark/p{i}', 'private': False, 'name': f'p{i}',
+         'description': f'Benchmark participant p{i}', 'country': 'CH', 'programming': 'Python', 'performance': i + 1}
+        for i in range(count)]}
+    server.lock = threading.Lock()
+    server.uploads = 0
+    server.uploaded = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # the docker engine of the host is never used, the control operations are either served by a stand-in of the
+    # Docker Engine API or, when there is no socket, run by the docker shim
+    docker_socket = os.path.join(directory, 'docker.sock')
+    docker_engine = DockerEngine(docker_socket, state) if not docker_cli else None
+
+    env = dict(os.environ,
+               PATH=SHIMS_DIRECTORY + os.pathsep + os.environ['PATH'],
+               HOME=home,
+               BENCHMARK_STATE=state,
+               BENCHMARK_GAME_TIME=str(game_time),
+               BENCHMARK_CRASH=scenario.get('crash', ''),
+               BENCHMARK_EXIT=scenario.get('exit', ''),
+               BENCHMARK_CONTROLLER_LINES=str(scenario.get('controller-lines', 10)),
+               BENCHMARK_ANIMATION_SIZE=str(scenario.get('animation-size', 1024 * 1024)),
+               BENCHMARK_TARGET=str(count // 2),  # the new participant climbs to the middle of the ranking
+               WEBOTS_CLOUD_URL=f'http://127.0.0.1:{server.server_port}',
+               DOCKER_HOST=f'unix://{docker_socket}',
+               CACHE_DIRECTORY=cache_directory or os.path.join(directory, 'cache'),
+               GITHUB_REPOSITORY=REPOSITORY,
+               PARTICIPANT_REPO_ID='challenger',
+               PARTICIPANT_REPO_NAME='benchmark/challenger',
+               PARTICIPANT_REPO_PRIVATE='false',
+               OPPONENT_REPO_NAME='',
+               LOG_URL='http://127.0.0.1/log',
+               REPO_TOKEN='benchmark',
+               UPLOAD_PERFORMANCE='true')
+    runs = scenario.get('runs', 1)
+    results = []
+    for run in range(runs):
+        work = os.path.join(directory, f'work{run}')
+        _create_project(work, world, run if scenario.get('update-world') else 0)
+        if run > 0 and scenario.get('update-description'):
+            _update_description(state, 'benchmark/challenger', run)
+        server.uploads = 0
+        server.uploaded = 0
+        upload_failures = scenario.get('upload-failures', [])
+        server.failure_mode = upload_failures[run] if run < len(upload_failures) else None
+        server.failed = set()
+        server.failures = 0
+        start = time.time()
+        interrupted = False
+        with open(os.path.join(work, 'benchmark.log'), 'w') as log:
+            job = subprocess.Popen([sys.executable, '-u', '-m', 'metascript'], cwd=work, env=env, stdout=log,
+                                   stderr=subprocess.STDOUT, start_new_session=True)
+            try:
+                return_code = job.wait(timeout=scenario.get('interrupt') if run == 0 else None)
+            except subprocess.TimeoutExpired:  # the runner is lost, with the containers of the job
+                os.killpg(job.pid, signal.SIGKILL)
+                return_code = job.wait()
+                interrupted = True
+        duration = time.time() - start
+        result = _get_result(f'{name}#{run + 1}' if runs > 1 else name, count, world, work, return_code, duration,
+                             server, game_time)
+        if server.failure_mode is not None:
+            _check_upload_failures(result, server, env['CACHE_DIRECTORY'], work)
+        if scenario.get('check-performance'):  # the performance reported by the world is recorded, not a failure
+            performance = next(p['performance'] for p in server.participants['participants'] if p['id'] == 'challenger')
+            result['failed_checks'] = [] if performance != -1 else ['the performance is not -1']
+        if interrupted:
+            result['interrupted'] = True
+            result.pop('log', None)
+        if keep:
+            result['directory'] = directory
+        results.append(result)
+    server.shutdown()
+    if docker_engine is not None:
+        docker_engine.close()
+    if not keep:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def _create_project(work, world, revision=0):
+    shutil.copytree(os.path.join(ROOT_DIRECTORY, 'metascript'), os.path.join(work, 'metascript'),
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    os.makedirs(os.path.join(work, 'worlds'))
+    with open(os.path.join(work, 'worlds', 'benchmark.wbt'), 'w') as f:
+        f.write(WORLD + (f'# revision {revision}\n' if revision else ''))
+    with open(os.path.join(work, 'Dockerfile'), 'w') as f:
+        f.write('FROM cyberbotics/webots.cloud:R2023b\n')
+    with open(os.path.join(work, 'webots.yml'), 'w') as f:
+        yaml.dump({'type': 'competition', 'world': world}, f)
+    # the competition repository is checked out by the workflow, its tree identifies the Webots image
+    subprocess.check_call(['git', 'init', '-q', work])
+    subprocess.check_call(['git', '-C', work, 'add', 'Dockerfile', 'webots.yml', 'worlds'])
+    subprocess.check_call(['git', '-C', work, 'commit', '-q', '-m', 'Competition'], env=_git_environment())
+
+
+def _update_description(state, repository, run):
+    # commit a change of participant.json only, in the repository generated by the git shim
+    path = os.path.join(state, 'repositories', repository.replace('/', '_'))
+    filename = os.path.join(path, 'controllers', 'participant', 'participant.json')
+    with open(filename) as f:
+        data = json.load(f)
+    data['description'] = f'Benchmark participant {data["name"]}, submission {run + 1}'
+    with open(filename, 'w') as f:
+        json.dump(data, f)
+    subprocess.check_call(['git', '-C', path, 'commit', '-q', '-a', '-m', 'Update the description'],
+                          env=_git_environment())
+
+
+def _git_environment():
+    return dict(os.environ, GIT_AUTHOR_NAME='benchmark', GIT_AUTHOR_EMAIL='benchmark@localhost',
+                GIT_COMMITTER_NAME='benchmark', GIT_COMMITTER_EMAIL='benchmark@localhost',
+                GIT_AUTHOR_DATE='2023-01-02T00:00:00Z', GIT_COMMITTER_DATE='2023-01-02T00:00:00Z')
+
+
+def _get_result(name, count, world, work, return_code, duration, server, game_time):
+    result = {'scenario': name, 'participants': count, 'world': world, 'return_code': return_code,
+              'duration': round(duration, 3), 'uploads': server.uploads, 'uploaded': server.uploaded}
+    report_file = os.path.join(work, 'timing.json')
+    if os.path.exists(report_file):
+        with open(report_file) as f:
+            report = json.load(f)
+        games = [span for span in report['spans'] if span['name'] == 'game']
+        result['upload_spans'] = [span for span in report['spans'] if span['name'] == 'upload']
+        result['phases'] = report['phases']
+        result['games'] = len(games)
+        # the time not spent playing the games themselves is the overhead of the orchestration
+        played = sum(game['simulated_time'] if game.get('simulated_time') is not None else game_time for game in games)
+        result['overhead'] = round(duration - played, 3)
+    if return_code != 0:
+        with open(os.path.join(work, 'benchmark.log')) as f:
+            result['log'] = f.read()[-4000:]
+    return result
+
+
+def _check_upload_failures(result, server, cache_directory, work):
+    # the uploads failing once are retried, and the journal is kept when webots.cloud is down, so that a retry of the
+    # job resumes it
+    journals = os.path.join(cache_directory, 'journals')
+    journal_kept = os.path.isdir(journals) and any(os.listdir(os.path.join(journals, name))
+                                                   for name in os.listdir(journals))
+    with open(os.path.join(work, 'benchmark.log')) as f:
+        log = f.read()
+    result['upload_failures'] = server.failures
+    result['retried_uploads'] = sum(1 for span in result.get('upload_spans', []) if span.get('attempts', 1) > 1)
+    result['replayed_games'] = log.count('(game decided by an interrupted job)')
+    if server.failure_mode == 'always':
+        result['expected_failure'] = True
+        checks = {'the job fails': result['return_code'] != 0, 'the journal is kept': journal_kept}
+    else:
+        checks = {'the job succeeds': result['return_code'] == 0,
+                  'every upload is retried once': result['retried_uploads'] == server.failures == len(server.failed),
+                  'the journal is removed': not journal_kept}
+    result['failed_checks'] = [check for check, passed in checks.items() if not passed]
+    if result['failed_checks']:
+        result['log'] = log[-4000:]
+    else:  # the log of an expected failure is not printed
+        result.pop('log', None)
+
+
+def _get_multipart_file(body, content_type, name):
+    boundary = content_type.split('boundary=')[1].encode('utf-8')
+    for part in body.split(b'--' + boundary):
+        headers, _, content = part.partition(b'\r\n\r\n')
+        if f'name="{name}"'.encode('utf-8') in headers:
+            return content[:-2]  # without the line break preceding the next boundary
+    return None
+
+
+def print_result(result):
+    status = 'ok' if result['return_code'] == 0 else 'interrupted' if result.get('interrupted') \
+        else f'failed as expected ({result["return_code"]})' if result.get('expected_failure') \
+        else f'failed ({result["return_code"]})'
+    if result.get('failed_checks'):
+        status = f'check failed: {", ".join(result["failed_checks"])}'
+    print(f'{result["scenario"]}: {status}, {result["participants"]} participants, {result.get("games", 0)} games, '
+          + f'{result["duration"]:.2f} s total, {result.get("overhead", 0):.2f} s overhead, '
+          + f'{result["uploads"]} uploads ({result["uploaded"] / 1024 ** 2:.1f} MB)')
+    for phase, timing in sorted(result.get('phases', {}).items(), key=lambda item: -item[1]['duration']):
+        print(f'  {phase:20} {timing["count"]:6} x {timing["duration"] / timing["count"]:8.3f} s '
+              + f'= {timing["duration"]:9.3f} s')
+    if 'upload_failures' in result:
+        print(f'  {result["upload_failures"]} failed uploads, {result["retried_uploads"]} retried, '
+              + f'{result["replayed_games"]} games replayed from the journal')
+    if 'log' in result:
+        print(result['log'])
+    if 'directory' in result:
+        print(f'  kept in {result["directory"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the orchestration of the competition record action.')
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS),
+                        help=f'Scenarios to run among {", ".join(SCENARIOS)} (default: all)')
+    parser.add_argument('--world', action='append', default=[], metavar='KEY=VALUE',
+                        help='Override a key of the world section of webots.yml, e.g. ranking-search=galloping')
+    parser.add_argument('--game-time', type=float, default=0.1, help='Wall time of a game in seconds')
+    parser.add_argument('--cache-directory', help='Cache directory shared by the runs, to benchmark warm caches')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directories of the runs')
+    parser.add_argument('--docker-cli', action='store_true',
+                        help='Control the containers with the docker CLI rather than the Docker Engine API')
+    args = parser.parse_args()
+    world_overrides = {}
+    for override in args.world:
+        key, value = override.split('=', 1)
+        world_overrides[key] = yaml.safe_load(value)
+
+    results = []
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario: {name}')
+        for result in run_scenario(name, SCENARIOS[name], world_overrides, args.game_time, args.cache_directory,
+                                   args.keep, args.docker_cli):
+            print_result(result)
+            results.append(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if all((result['return_code'] == 0 or result.get('interrupted') or result.get('expected_failure'))
+                    and not result.get('failed_checks') for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
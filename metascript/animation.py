@@ -14,110 +14,70 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
-import select
+import re
 import subprocess
 import sys
+import threading
+import time
+from .match import Match, WEBOTS_QUIT_TIMEOUT
+from .utils import cpu, docker_engine, image_cache, resources, timing
+from .utils.multiplexer import LogMultiplexer, dispatch
 
 TMP_ANIMATION_DIRECTORY = 'tmp'
 PERFORMANCE_KEYWORD = 'performance:'
+ANIMATOR_COMMAND_FILE = 'animator.command'
+ANIMATION_SAVED_KEYWORD = 'Animation saved'
+HEARTBEAT_KEYWORD = 'Animator heartbeat'  # printed periodically by the animator while the simulation runs
+WATCHDOG_PERIOD = 1  # seconds between the checks of the state of the game
+CONTROLLER_EXIT_GRACE_PERIOD = 5  # seconds left to Webots to report the result of a game after a controller exited
+CONTROLLER_CONNECTION_TIMEOUT = 60  # seconds, default of controller-connection-timeout in webots.yml
+# seconds added to the connection timeout of the animator, whose clock starts before the controller containers
+ANIMATOR_CONNECTION_MARGIN = 10
+ANIMATION_READ_SIZE = 1024 * 1024
+MAX_ANIMATION_HEADER_SIZE = 64 * 1024 * 1024  # the header contains the list of ids
+SIMULATED_TIME_FILE = 'simulated_time'  # written by the animator at the end of a game
+ANIMATOR_SOURCE_DIRECTORY = os.path.join('metascript', 'animator')
+ANIMATOR_DIRECTORY = os.path.join('controllers', 'animator')  # copied in the competition repository by the action
+BACKGROUND_CPU_SHARES = 2  # the minimum CPU weight, given to the builds running alongside a game
+SEED_VARIABLE = 'COMPETITION_SEED'  # environment variable of Webots and of the controllers giving the seed of a run
+RECORDED_WORLD_SUFFIX = '_recorder'  # the world with the animator supervisor, generated next to the competition world
 
 
 # return 1 if participant wins, 0 if participant loses and -1 if participant fails (due to an error)
+# the webots world and image are checked on the first run, the images are only built if not cached
 def record_animations(gpu, config, participant_controller_path, participant_name,
-                      opponent_controller_path=None, opponent_name='', first_run=True):
+                      opponent_controller_path=None, opponent_name='', first_run=True, match=None, seed=None):
     world_config = config['world']
     performance = 0
+    warm = world_config['warm-webots'] if 'warm-webots' in world_config else False
+    if match is None:
+        match = Match()
 
     # Create temporary directory for animations, textures and meshes
     # This is necessary otherwise we cannot delete these files from outside of the container
-    subprocess.check_output(['mkdir', '-p', os.path.join(TMP_ANIMATION_DIRECTORY, 'textures')])
-    subprocess.check_output(['mkdir', '-p', os.path.join(TMP_ANIMATION_DIRECTORY, 'meshes')])
-
-    if first_run:
-        # Temporary world file changes
-        with open(world_config['file'], 'r') as f:
-            world_content = f.read()
-        world_content = world_content.replace('controller "participant"', 'controller "<extern>"')
-        if opponent_controller_path:
-            world_content = world_content.replace('controller "opponent"', 'controller "<extern>"')
-        world_content += f'''
-        DEF ANIMATION_RECORDER_SUPERVISOR Robot {{
-        name "animation_recorder_supervisor"
-        controller "animator"
-        controllerArgs [
-            "--duration={world_config['max-duration']}"
-            "--output={TMP_ANIMATION_DIRECTORY}"
-        ]
-        supervisor TRUE
-        }}
-        '''
+    subprocess.check_output(['mkdir', '-p', os.path.join(match.output_directory, 'textures')])
+    subprocess.check_output(['mkdir', '-p', os.path.join(match.output_directory, 'meshes')])
 
-        with open(world_config['file'], 'w') as f:
-            f.write(world_content)
+    world_file, webots_image = _prepare_webots_image(world_config, bool(opponent_controller_path), warm, first_run)
 
-        # Building the Docker containers
-        print('::group::Building \033[32mWebots\033[0m docker')
-        recorder_build = subprocess.Popen(
-            [
-                'docker', 'build',
-                '--tag', 'recorder-webots',
-                '--file', 'Dockerfile',
-                '.'
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            encoding='utf-8'
-        )
-        return_code = _get_realtime_stdout(recorder_build)
-        print('::endgroup::')
-        if return_code != 0:
-            print('::error ::Missing or misconfigured Dockerfile while building the Webots container')
-            sys.exit(1)
+    if not _build_controller_image(match, 'participant', participant_controller_path, participant_name):
+        print('::error ::Missing or misconfigured Dockerfile while building the participant controller container')
+        return -1
 
-        print(f'::group::Building \033[31mparticipant\033[0m docker (\033[31m{participant_name}\033[0m)')
-        participant_controller_build = subprocess.Popen(
-            [
-                'docker', 'build',
-                '--tag', 'participant-controller',
-                '--file', f'{participant_controller_path}/controllers/Dockerfile',
-                '--build-arg', 'WEBOTS_CONTROLLER_URL=participant',
-                f'{participant_controller_path}/controllers'
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            encoding='utf-8'
-        )
-        return_code = _get_realtime_stdout(participant_controller_build)
-        print('::endgroup::')
-        if return_code != 0:
-            print('::error ::Missing or misconfigured Dockerfile while building the participant controller container')
-            return -1
+    if opponent_controller_path and not _build_controller_image(match, 'opponent', opponent_controller_path, opponent_name):
+        print('::warning ::Missing or misconfigured Dockerfile while building the opponent controller container')
+        print(f'::notice ::{participant_name} won over {opponent_name}')
+        return 1  # the game cannot be played without the opponent image
 
-    if opponent_controller_path:
-        print(f'::group::Building \033[34mopponent\033[0m docker (\033[34m{opponent_name}\033[0m)')
-        opponent_controller_build = subprocess.Popen(
-            [
-                'docker', 'build',
-                '--tag', 'opponent-controller',
-                '--file', f'{opponent_controller_path}/controllers/Dockerfile',
-                '--build-arg', 'WEBOTS_CONTROLLER_URL=opponent',
-                f'{opponent_controller_path}/controllers'
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            encoding='utf-8'
-        )
-        return_code = _get_realtime_stdout(opponent_controller_build)
-        print('::endgroup::')
-        if return_code != 0:
-            print('::warning ::Missing or misconfigured Dockerfile while building the opponent controller container')
-            performance = 1
-
-    webots_old_container_id = _get_container_id('recorder-webots')
-    if webots_old_container_id != '':  # A zombie webots container may still be there due to a previous crash
-        print('::warning ::Killing a Webots zombie process left by the previous job')
-        subprocess.run(['docker', 'kill', webots_old_container_id], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for role in ['webots', 'participant', 'opponent']:
+        if role == 'webots' and match.warm:  # the warm Webots container of the match is kept across games
+            continue
+        old_container_ids = _get_container_ids(match, role, True)
+        if old_container_ids:  # A zombie container may still be there due to a previous crash
+            print(f'::warning ::Killing a {role} zombie container left by a previous attempt of the job')
+            docker_engine.remove(old_container_ids)
 
     # Run Webots container with Popen to read the stdout
     if opponent_controller_path:
@@ -125,142 +85,74 @@ def record_animations(gpu, config, participant_controller_path, participant_name
               + f'versus \033[34m{opponent_name}\033[0m')
     else:
         print(f'::group::Running evaluation in \033[32mWebots\033[0m of \033[31m{participant_name}\033[0m')
-    command_line = ['docker', 'run', '--tty', '--rm']
-    cpu_count = os.cpu_count()
-    if cpu_count == 1:
-        webots_cpuset_cpus = '0'
-        participant_cpuset_cpus = '0'
-        opponent_cpuset_cpus = '0'
-    elif cpu_count == 2:
-        webots_cpuset_cpus = '0'
-        participant_cpuset_cpus = '1'
-        opponent_cpuset_cpus = '1'
-    elif cpu_count == 4:
-        webots_cpuset_cpus = '0,1'
-        participant_cpuset_cpus = '2'
-        opponent_cpuset_cpus = '3'
-    elif cpu_count >= 8:
-        cpus = world_config['cpus'] if 'cpus' in world_config else 1
-        if cpus == 3:
-            webots_cpuset_cpus = '0,4'
-            participant_cpuset_cpus = '1,5,3'
-            opponent_cpuset_cpus = '2,6,7'
-        elif cpus == 2:
-            webots_cpuset_cpus = '0,3,4,7'
-            participant_cpuset_cpus = '1,5'
-            opponent_cpuset_cpus = '2,6'
-        else:
-            webots_cpuset_cpus = '0,3,4,5,6,7'
-            participant_cpuset_cpus = '1'
-            opponent_cpuset_cpus = '2'
-            if cpus != 1:
-                print(f'::warning ::Unsupported number of CPUs for controllers: {cpus} (cpus in webots.yml)')
-        if cpu_count != 8:
-            print(f'::warning ::CPU core count is {cpu_count}, using only 8 cores')
+    cpusets = match.cpusets if match.cpusets is not None else cpu.allocate(world_config)[0][0]
+    webots_cpuset_cpus = cpusets.get('webots')
+    # the names and the seed of the game are passed to the world through environment variables
+    environment = {'PARTICIPANT_NAME': participant_name, 'OPPONENT_NAME': opponent_name}
+    if seed is not None:
+        environment[SEED_VARIABLE] = str(seed)
+    start = time.time()
+
+    if warm:
+        webots_docker = _get_warm_webots(gpu, match, world_file, webots_image, webots_cpuset_cpus, environment)
     else:
-        webots_cpuset_cpus = None
-        participant_cpuset_cpus = None
-        opponent_cpuset_cpus = None
-        print(f'::warning ::Unsupported CPU count value: {cpu_count}')
+        command_line = ['docker', 'run', '--tty', '--rm', '--name', match.name('webots')]
+        for label in match.labels('webots'):
+            command_line += ['--label', label]
+        if webots_cpuset_cpus:
+            command_line += [f'--cpuset-cpus={webots_cpuset_cpus}']
 
-    if webots_cpuset_cpus:
-        command_line += [f'--cpuset-cpus={webots_cpuset_cpus}']
+        if gpu:
+            command_line += ['--gpus', 'all', '--env', 'DISPLAY',
+                             '--volume', '/tmp/.X11-unix:/tmp/.X11-unix:ro']
+        else:
+            command_line += ['--init']
 
-    if gpu:
-        command_line += ['--gpus', 'all', '--env', 'DISPLAY',
-                         '--volume', '/tmp/.X11-unix:/tmp/.X11-unix:ro']
-    else:
-        command_line += ['--init']
+        if opponent_controller_path:
+            command_line += ['--volume', match.ipc('opponent')]
 
-    if opponent_controller_path:
-        command_line += ['--volume', '/tmp/webots/root/1234/ipc/opponent:/tmp/webots/root/1234/ipc/opponent']
-
-    command_line += [
-        '--volume', '/tmp/webots/root/1234/ipc/participant:/tmp/webots/root/1234/ipc/participant',
-        '--mount', 'type=bind,'
-                   + f'source={os.getcwd()}/{TMP_ANIMATION_DIRECTORY},'
-                   + f'target=/usr/local/webots-project/{TMP_ANIMATION_DIRECTORY}',
-        '--env', 'CI=true',
-        '--env', f'PARTICIPANT_NAME={participant_name}',
-        '--env', f'OPPONENT_NAME={opponent_name}',
-        'recorder-webots']
-
-    if not gpu:
-        command_line += ['xvfb-run', '-e', '/dev/stdout', '-a']
-    command_line += ['webots', '--stdout', '--stderr', '--batch', '--minimize', '--mode=fast',
-                     '--no-rendering', f'/usr/local/webots-project/{world_config["file"]}']
-
-    webots_docker = subprocess.Popen(command_line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8')
-    print(' '.join(command_line))
+        command_line += [
+            '--volume', match.ipc('participant'),
+            '--mount', 'type=bind,'
+                       + f'source={os.getcwd()}/{match.output_directory},'
+                       + f'target=/usr/local/webots-project/{TMP_ANIMATION_DIRECTORY}',
+            '--env', 'CI=true']
+        for variable, value in environment.items():
+            command_line += ['--env', f'{variable}={value}']
+        command_line += [webots_image]
 
-    participant_docker = None
-    opponent_docker = None
-    participant_controller_connected = False
-    opponent_controller_connected = False
-    timeout = False
-    participant_line_count = 0
-    opponent_line_count = 0
-    while webots_docker.poll() is None:
-        fds = [webots_docker.stdout]
-        if participant_docker:
-            fds.append(participant_docker.stdout)
-        if opponent_docker:
-            fds.append(opponent_docker.stdout)
-        fd = select.select(fds, [], [])[0]
-        webots_line = webots_docker.stdout.readline().strip() if webots_docker.stdout in fd else None
-        participant_available = participant_docker and participant_docker.stdout in fd
-        participant_line = participant_docker.stdout.readline().strip() if participant_available else None
-        opponent_available = opponent_docker and opponent_docker.stdout in fd
-        opponent_line = opponent_docker.stdout.readline().strip() if opponent_available else None
-        if participant_line:
-            if participant_line_count < 100:
-                print(f'\033[31m{participant_line}\033[0m')
-            elif participant_line_count == 100:
-                print(f'Participant \033[31m{participant_name}\033[0m printed more than 100 lines, ignoring further prints')
-            participant_line_count += 1
-        if opponent_line:
-            if opponent_line_count < 100:
-                print(f'\033[34m{opponent_line}\033[0m')
-            elif opponent_line_count == 100:
-                print(f'Opponent \033[34m{opponent_name}\033[0m printed more than 100 lines, ignoring further prints')
-            opponent_line_count += 1
-        if webots_line is None:
-            continue
-        print(f'\033[32m{webots_line}\033[0m')
-        if "' extern controller: connected" in webots_line:
-            if webots_line.startswith("INFO: 'participant' "):
-                participant_controller_connected = True
-            elif webots_line.startswith("INFO: 'opponent' "):
-                opponent_controller_connected = True
-        elif "' extern controller: " in webots_line:
-            command_line = ['docker', 'run', '--rm']
-            if gpu:
-                command_line += ['--gpus', 'all']
-            if 'memory' in world_config:
-                command_line += [f'--memory={world_config["memory"]}']
-            command_line += ['--network', 'none', '--volume']
-            if participant_docker is None and webots_line.startswith("INFO: 'participant' "):
-                command_line += ['/tmp/webots/root/1234/ipc/participant:/tmp/webots/root/1234/ipc/participant']
-                if participant_cpuset_cpus:
-                     command_line += [f'--cpuset-cpus={participant_cpuset_cpus}']
-                command_line += ['participant-controller']
-                participant_docker = subprocess.Popen(command_line,
-                                                      stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8')
-                print(' '.join(command_line))
-            elif opponent_docker is None and webots_line.startswith("INFO: 'opponent' "):
-                command_line += ['/tmp/webots/root/1234/ipc/opponent:/tmp/webots/root/1234/ipc/opponent']
-                if opponent_cpuset_cpus:
-                    command_line += [f'--cpuset-cpus={opponent_cpuset_cpus}']
-                command_line += ['opponent-controller']
-                opponent_docker = subprocess.Popen(command_line,
-                                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8')
-                print(' '.join(command_line))
-        elif PERFORMANCE_KEYWORD in webots_line:
-            performance = float(webots_line.strip().replace(PERFORMANCE_KEYWORD, ''))
-            break
-        elif 'Controller timeout' in webots_line:
-            timeout = True
-            break
+        if not gpu:
+            command_line += ['xvfb-run', '-e', '/dev/stdout', '-a']
+        command_line += _get_webots_arguments(world_file)
+
+        webots_docker = subprocess.Popen(command_line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        print(' '.join(command_line))
+
+    multiplexer = LogMultiplexer()
+    game = _Game(gpu, world_config, match, cpusets, participant_name, opponent_name, bool(opponent_controller_path),
+                 multiplexer, start, seed)
+    game.create_controllers()  # while Webots is starting
+    sampling_period = world_config['resource-sampling-period'] if 'resource-sampling-period' in world_config else 1
+    sampler = None  # the usage of the resources is only measured with cgroup v2
+    if sampling_period and resources.available():
+        roles = ['webots', 'participant', 'opponent'] if opponent_controller_path else ['webots', 'participant']
+        sampler = resources.ResourceSampler(match, roles, sampling_period, ['webots'] if warm else [])
+    multiplexer.add('webots', webots_docker.stdout, game.on_webots_line)
+    while not game.finished and multiplexer.is_open('webots'):
+        multiplexer.poll(WATCHDOG_PERIOD)
+        game.check()
+    if not game.finished:  # the output of Webots was closed
+        webots_docker.wait()
+    resource_usage = sampler.stop() if sampler is not None else None
+    for role, usage in (resource_usage or {}).items():
+        print(f'Resources used by {resources.format_summary(role, usage)}')
+    if game.performance is not None:
+        performance = game.performance
+    participant_docker = game.participant_docker
+    opponent_docker = game.opponent_docker
+    participant_controller_connected = game.participant_controller_connected
+    opponent_controller_connected = game.opponent_controller_connected
+    timeout = game.timeout
     if webots_docker.returncode:
         print(f'::error ::Webots container exited with code {webots_docker.returncode}')
         performance = -1
@@ -277,7 +169,22 @@ def record_animations(gpu, config, participant_controller_path, participant_name
               + 'the opponent controller failed to connect to Webots, therefore you won')
         performance = 1
 
-    _close_containers()
+    wall_time = time.time() - start
+    game.discard_created_controllers()
+    if warm:  # the animation is exported by the animator which then waits for the next game
+        _save_warm_animation(match)
+        _close_containers(match, False)
+    else:
+        with timing.span('animation_export', match=match.slot):
+            _close_containers(match)
+            _wait_for_webots(match, webots_docker, multiplexer)
+    game.close()
+    multiplexer.close()
+    simulated_time = _read_simulated_time(match)
+    timing.record('game', start, wall_time, match=match.slot, participant=participant_name, opponent=opponent_name,
+                  simulated_time=simulated_time,
+                  real_time_factor=round(simulated_time / wall_time, 3) if simulated_time is not None else None,
+                  resources=resource_usage)
 
     # compute performance line
     if timeout:
@@ -296,9 +203,544 @@ def record_animations(gpu, config, participant_controller_path, participant_name
     return performance
 
 
-def _get_container_id(container_name):
-    container_id = subprocess.check_output(['docker', 'ps', '-f', f'ancestor={container_name}', '-q']).decode('utf-8').strip()
-    return container_id
+def prepare_webots(config, versus=False):
+    '''Generate the recorded world and build the Webots image, so that games can then be run concurrently.'''
+
+    world_config = config['world']
+    warm = world_config['warm-webots'] if 'warm-webots' in world_config else False
+    _prepare_webots_image(world_config, versus, warm, True)
+
+
+def webots_image_tag(config, versus=False):
+    '''Return the tag of the Webots image of the games, or None if it is not identified by its content.'''
+
+    world_config = config['world']
+    warm = world_config['warm-webots'] if 'warm-webots' in world_config else False
+    _, tag = _prepare_webots_image(world_config, versus, warm, False)
+    return tag if tag != image_cache.WEBOTS_IMAGE_REPOSITORY else None
+
+
+class _Game:
+    '''State of a running game, updated by the handlers of the container outputs.'''
+
+    def __init__(self, gpu, world_config, match, cpusets, participant_name, opponent_name, versus, multiplexer, start,
+                 seed=None):
+        self.gpu = gpu
+        self.seed = seed
+        self.world_config = world_config
+        self.match = match
+        self.cpusets = cpusets
+        self.names = {'participant': participant_name, 'opponent': opponent_name}
+        self.versus = versus  # whether an opponent controller takes part in the game
+        self.multiplexer = multiplexer
+        self.participant_docker = None
+        self.opponent_docker = None
+        self.participant_controller_connected = False
+        self.opponent_controller_connected = False
+        self.performance = None
+        self.timeout = False
+        self.finished = False
+        self.line_counts = {'participant': 0, 'opponent': 0}
+        self.start = start  # time at which Webots was started
+        self.created = {}  # docker create process of each controller container created ahead of its start
+        self.controller_starts = {}  # time at which each controller container was started
+        self.controller_launches = {}  # how each controller container was started: 'start' if it was created, or 'run'
+        self.controller_exits = {}  # time at which each controller container crashed before the end of the game
+        self.controller_clean_exits = set()  # controllers which exited with code 0, the world still gives the result
+        self.controller_exit_codes = {}  # exit code of each controller container reported by the Docker Engine API
+        self.exit_waiters = {}  # threads waiting for the controller containers to exit through the Docker Engine API
+        self.exit_lock = threading.Lock()
+        self.exit_pipe = None  # written by the waiters to wake up the watchdog as soon as a controller exited
+        if docker_engine.client() is not None:
+            read, self.exit_pipe = os.pipe()
+            self.exit_events = os.fdopen(read, 'rb')
+            multiplexer.add('exits', self.exit_events, lambda line: None)  # check() is called after each poll
+        self.last_output = start  # time of the last line printed by Webots
+        self.started = False  # whether all the controllers are connected and the game is running
+        self.connection_timeout = world_config['controller-connection-timeout'] \
+            if 'controller-connection-timeout' in world_config else CONTROLLER_CONNECTION_TIMEOUT
+        self.output_timeout = world_config['webots-output-timeout'] if 'webots-output-timeout' in world_config else 60
+        # the first event whose keyword is found in a line of Webots is handled
+        self.dispatch = dispatch([
+            ("' extern controller: connected", self.on_controller_connected),
+            ("' extern controller: ", self.on_controller_waiting),
+            (PERFORMANCE_KEYWORD, self.on_performance),
+            ('Controller timeout', self.on_timeout)
+        ])
+
+    def on_webots_line(self, webots_line):
+        self.last_output = time.time()
+        if self.finished or HEARTBEAT_KEYWORD in webots_line:
+            return
+        print(f'\033[32m{webots_line}\033[0m')
+        self.dispatch(webots_line)
+
+    def check(self):
+        '''Stop the game if a controller exited, did not connect in time or if Webots is stuck.'''
+
+        now = time.time()
+        for role, docker, connected in [('participant', self.participant_docker, self.participant_controller_connected),
+                                        ('opponent', self.opponent_docker, self.opponent_controller_connected)]:
+            if docker is None:
+                continue
+            exit_code = self.controller_exit_code(role, docker)
+            if role not in self.controller_exits and role not in self.controller_clean_exits \
+                    and exit_code is not None:
+                if exit_code:
+                    print(f'::warning ::The {role} controller container exited with code {exit_code} '
+                          + 'before the end of the game')
+                    self.controller_exits[role] = now
+                else:  # e.g. a controller which completed its task, the game goes on until the world reports its result
+                    print(f'The {role} controller container exited before the end of the game')
+                    self.controller_clean_exits.add(role)
+            if role in self.controller_exits and now - self.controller_exits[role] > CONTROLLER_EXIT_GRACE_PERIOD:
+                # the result of a controller which never connected is given by the checks following the game
+                if connected:
+                    self.performance = 1 if role == 'opponent' else 0 if self.versus else -1
+                self.finished = True
+            elif not connected and now - self.controller_starts[role] > self.connection_timeout:
+                print(f'::warning ::The {role} controller did not connect to Webots within {self.connection_timeout} '
+                      + 'seconds (controller-connection-timeout in webots.yml)')
+                self.finished = True
+        if (self.started or not self.controller_starts) and now - self.last_output > self.output_timeout:
+            print(f'::error ::Webots did not print anything for {self.output_timeout} seconds, it seems to be stuck '
+                  + '(webots-output-timeout in webots.yml)')
+            self.performance = -1
+            self.finished = True
+
+    def controller_exit_code(self, role, docker):
+        '''Return the exit code of a controller container, or None if it is still running.'''
+
+        if self.controller_exit_codes.get(role) is not None:
+            return self.controller_exit_codes[role]
+        # the docker CLI process exits with the container, e.g. if it could not be waited for through the API
+        return docker.poll()
+
+    def wait_for_exit(self, role):  # run by the waiter thread of the controller
+        self.controller_exit_codes[role] = docker_engine.wait(self.match.name(role))
+        with self.exit_lock:
+            if self.exit_pipe is not None:
+                os.write(self.exit_pipe, b'\n')
+
+    def close(self):
+        '''Stop waiting for the controller containers, which are removed once the game is over.'''
+
+        for waiter in self.exit_waiters.values():
+            waiter.join(docker_engine.API_TIMEOUT)
+        with self.exit_lock:
+            if self.exit_pipe is not None:
+                self.multiplexer.remove('exits')
+                self.exit_events.close()
+                os.close(self.exit_pipe)
+                self.exit_pipe = None
+
+    def on_controller_connected(self, webots_line):
+        if webots_line.startswith("INFO: 'participant' "):
+            self.participant_controller_connected = True
+            self.record_connection('participant')
+        elif webots_line.startswith("INFO: 'opponent' "):
+            self.opponent_controller_connected = True
+            self.record_connection('opponent')
+
+    def record_connection(self, role):
+        if role in self.controller_starts:
+            start = self.controller_starts[role]
+            timing.record('controller_connect', start, time.time() - start, match=self.match.slot, role=role,
+                          controller=self.names[role], launch=self.controller_launches[role])
+        # the animator starts the game as soon as all the controllers are connected
+        if self.participant_controller_connected and (self.opponent_controller_connected or not self.versus):
+            _send_animator_command(self.match, 'start')
+            self.started = True
+            self.last_output = time.time()
+
+    def on_controller_waiting(self, webots_line):
+        if not self.controller_starts:  # Webots is ready when it waits for the first controller
+            timing.record('webots_start', self.start, time.time() - self.start, match=self.match.slot)
+        if self.participant_docker is None and webots_line.startswith("INFO: 'participant' "):
+            self.participant_docker = self.start_controller('participant')
+        elif self.opponent_docker is None and webots_line.startswith("INFO: 'opponent' "):
+            self.opponent_docker = self.start_controller('opponent')
+
+    def on_performance(self, webots_line):
+        self.performance = float(webots_line.strip().replace(PERFORMANCE_KEYWORD, ''))
+        self.finished = True
+
+    def on_timeout(self, webots_line):
+        self.timeout = True
+        self.finished = True
+
+    def create_controllers(self):
+        '''Create the controller containers, so that they are only started when Webots waits for them.'''
+
+        for role in ['participant', 'opponent'] if self.versus else ['participant']:
+            self.created[role] = subprocess.Popen(['docker', 'create', '--rm'] + self.controller_options(role),
+                                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def discard_created_controllers(self):  # the containers which were never started are removed with the others
+        for created in self.created.values():
+            created.communicate()
+        self.created = {}
+
+    def controller_options(self, role):
+        options = []
+        if self.gpu:
+            options += ['--gpus', 'all']
+        if 'memory' in self.world_config:
+            options += [f'--memory={self.world_config["memory"]}']
+        if self.seed is not None:
+            options += ['--env', f'{SEED_VARIABLE}={self.seed}']
+        options += ['--network', 'none', '--name', self.match.name(role), '--volume', self.match.ipc(role)]
+        for label in self.match.labels(role):
+            options += ['--label', label]
+        if self.cpusets.get(role):
+            options += [f'--cpuset-cpus={self.cpusets[role]}']
+        options += [self.match.images[role]]
+        return options
+
+    def start_controller(self, role):
+        self.controller_starts[role] = time.time()
+        created = self.created.pop(role, None)
+        error = created.communicate()[1] if created is not None else b''
+        if created is not None and created.returncode == 0:
+            command_line = ['docker', 'start', '--attach', self.match.name(role)]
+            self.controller_launches[role] = 'start'
+        else:
+            if created is not None:
+                print(f'::warning ::The {role} controller container could not be created ahead of the game: '
+                      + error.decode('utf-8', 'replace').strip())
+            command_line = ['docker', 'run', '--rm'] + self.controller_options(role)
+            self.controller_launches[role] = 'run'
+        controller_docker = subprocess.Popen(command_line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        print(' '.join(command_line))
+        if self.exit_pipe is not None and self.controller_launches[role] == 'start':
+            # the container was created, its exit is awaited through the Docker Engine API rather than polled
+            self.exit_waiters[role] = threading.Thread(target=self.wait_for_exit, args=(role,), daemon=True)
+            self.exit_waiters[role].start()
+        self.multiplexer.add(role, controller_docker.stdout, lambda line: self.on_controller_line(role, line))
+        return controller_docker
+
+    def on_controller_line(self, role, line):
+        if not line:
+            return
+        color = '31' if role == 'participant' else '34'
+        if self.line_counts[role] < 100:
+            print(f'\033[{color}m{line}\033[0m')
+        else:
+            print(f'{role.capitalize()} \033[{color}m{self.names[role]}\033[0m printed more than 100 lines, '
+                  + 'ignoring further prints')
+            self.multiplexer.mute(role)  # the output is still drained so that the controller is never blocked
+        self.line_counts[role] += 1
+
+
+def _prepare_webots_image(world_config, versus, warm, build):
+    '''Generate the recorded world and return it with the tag of the Webots image, built if needed.'''
+
+    # the animator supervisor is added to a copy of the world, next to it so that its resources are found
+    with open(world_config['file'], 'r') as f:
+        world_content = f.read()
+    world_content = world_content.replace('controller "participant"', 'controller "<extern>"')
+    if versus:
+        world_content = world_content.replace('controller "opponent"', 'controller "<extern>"')
+    simulation_mode = world_config['simulation-mode'] if 'simulation-mode' in world_config else 'realtime'
+    warm_argument = '\n            "--warm"' if warm else ''
+    # the animator starts the game anyway once the controllers had the time to connect
+    connection_timeout = world_config['controller-connection-timeout'] \
+        if 'controller-connection-timeout' in world_config else CONTROLLER_CONNECTION_TIMEOUT
+    world_content += f'''
+        DEF ANIMATION_RECORDER_SUPERVISOR Robot {{
+        name "animation_recorder_supervisor"
+        controller "animator"
+        controllerArgs [
+            "--duration={world_config['max-duration']}"
+            "--output={TMP_ANIMATION_DIRECTORY}"
+            "--mode={simulation_mode}"
+            "--connection-timeout={connection_timeout + ANIMATOR_CONNECTION_MARGIN}"{warm_argument}
+        ]
+        supervisor TRUE
+        }}
+        '''
+    root, extension = os.path.splitext(world_config['file'])
+    world_file = f'{root}{RECORDED_WORLD_SUFFIX}{extension}'
+    if build:  # the world is generated once, it may be read by the games already running
+        with open(world_file, 'w') as f:
+            f.write(world_content)
+
+    # the animator copied in the build context is identified by its source, so that the tag is known before the copy
+    tag = image_cache.webots_tag(world_file, world_content, [ANIMATOR_SOURCE_DIRECTORY])
+    if not build:
+        return world_file, tag or image_cache.WEBOTS_IMAGE_REPOSITORY
+    if tag is not None and image_cache.exists(tag):
+        print(f'Using the cached \033[32mWebots\033[0m docker image {tag}')
+        image_cache.touch(tag)
+        return world_file, tag
+    print('::group::Building \033[32mWebots\033[0m docker')
+    with timing.span('build', image=image_cache.WEBOTS_IMAGE_REPOSITORY):
+        recorder_build = subprocess.Popen(
+            [
+                'docker', 'build',
+                '--tag', tag or image_cache.WEBOTS_IMAGE_REPOSITORY,
+                '--file', 'Dockerfile',
+                '.'
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding='utf-8'
+        )
+        return_code = _get_realtime_stdout(recorder_build)
+    print('::endgroup::')
+    if return_code != 0:
+        print('::error ::Missing or misconfigured Dockerfile while building the Webots container')
+        sys.exit(1)
+    if tag is None:  # not in a git repository, the image is built for each job
+        return world_file, image_cache.WEBOTS_IMAGE_REPOSITORY
+    image_cache.touch(tag)
+    return world_file, tag
+
+
+def _get_webots_arguments(world_file):
+    return ['webots', '--stdout', '--stderr', '--batch', '--minimize', '--mode=fast',
+            '--no-rendering', f'/usr/local/webots-project/{world_file}']
+
+
+def _get_warm_webots(gpu, match, world_file, webots_image, cpuset_cpus, environment):
+    # the running Webots instance is reset by the animator, which passes the environment variables of the game (controller
+    # names) to the controllers of the world, a new instance is only started for another seed as it may be read when the
+    # world is loaded
+    if match.webots is not None and match.webots.poll() is None:
+        if match.webots_seed == environment.get(SEED_VARIABLE):
+            print('Resetting the world of the warm \033[32mWebots\033[0m instance')
+            _send_animator_command(match, f'reset {json.dumps(environment)}')
+            return match.webots
+        match.quit_webots()
+    if not match.warm:
+        command_line = ['docker', 'run', '--detach', '--rm', '--name', match.name('webots')]
+        for label in match.labels('webots'):
+            command_line += ['--label', label]
+        if cpuset_cpus:
+            command_line += [f'--cpuset-cpus={cpuset_cpus}']
+        if gpu:
+            command_line += ['--gpus', 'all', '--env', 'DISPLAY',
+                             '--volume', '/tmp/.X11-unix:/tmp/.X11-unix:ro']
+        else:
+            command_line += ['--init', '--env', 'DISPLAY=:99']
+        command_line += [
+            '--volume', match.ipc('participant'),
+            '--volume', match.ipc('opponent'),
+            '--mount', 'type=bind,'
+                       + f'source={os.getcwd()}/{match.output_directory},'
+                       + f'target=/usr/local/webots-project/{TMP_ANIMATION_DIRECTORY}',
+            '--env', 'CI=true',
+            webots_image]
+        # the X server of the container replaces xvfb-run which would be restarted with each Webots instance
+        command_line += ['sleep', 'infinity'] if gpu else ['Xvfb', ':99', '-screen', '0', '1280x1024x24', '-nolisten', 'tcp']
+        subprocess.check_output(command_line)
+        print(' '.join(command_line))
+        match.warm = True
+    command_line = ['docker', 'exec', '--tty']
+    for variable, value in environment.items():
+        command_line += ['--env', f'{variable}={value}']
+    command_line += [match.name('webots')] + _get_webots_arguments(world_file)
+    match.webots = subprocess.Popen(command_line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    match.webots_seed = environment.get(SEED_VARIABLE)
+    print(' '.join(command_line))
+    return match.webots
+
+
+def _send_animator_command(match, command):
+    filename = os.path.join(match.output_directory, ANIMATOR_COMMAND_FILE)
+    with open(filename + '.tmp', 'w') as f:
+        f.write(command)
+    os.replace(filename + '.tmp', filename)  # the animator should never read a partial command
+
+
+def _save_warm_animation(match):
+    saved = []
+
+    def on_webots_line(webots_line):
+        print(f'\033[32m{webots_line}\033[0m')
+        if ANIMATION_SAVED_KEYWORD in webots_line:
+            saved.append(webots_line)
+
+    _send_animator_command(match, 'stop')
+    multiplexer = LogMultiplexer()
+    multiplexer.add('webots', match.webots.stdout, on_webots_line)
+    deadline = time.time() + WEBOTS_QUIT_TIMEOUT
+    with timing.span('animation_export', match=match.slot):
+        while not saved and multiplexer.is_open('webots') and time.time() < deadline:
+            multiplexer.poll(1)
+    webots_open = multiplexer.is_open('webots')
+    multiplexer.close()
+    if saved:
+        return
+    if not webots_open:  # Webots quit by itself, which exported the animation
+        match.webots.wait()
+        match.webots = None
+        return
+    print('::warning ::The warm Webots instance did not save the animation, it will be restarted for the next game')
+    match.quit_webots()
+
+
+def decimate_animation(filename, sample_period=None, delta=False):
+    '''Rewrite a recorded animation keeping one frame per sample period (in ms) and, if delta is set, only the fields
+    of the nodes which changed since the previous frame.
+
+    The frames are processed as a stream, so that the whole animation is never loaded in memory.'''
+
+    with open(filename, 'r', encoding='utf-8') as source, \
+            open(filename + '.tmp', 'w', encoding='utf-8') as destination:
+        buffer = source.read(ANIMATION_READ_SIZE)
+        start = buffer.find('"frames"')
+        while start == -1 and len(buffer) < MAX_ANIMATION_HEADER_SIZE:
+            chunk = source.read(ANIMATION_READ_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+            start = buffer.find('"frames"')
+        time_step_match = re.search(r'"basicTimeStep"\s*:\s*([0-9.]+)', buffer[:start]) if start != -1 else None
+        start = buffer.find('[', start) if start != -1 else -1
+        if start == -1 or time_step_match is None:
+            print(f'::warning ::Unexpected format of {filename}, the animation is not decimated')
+            os.remove(filename + '.tmp')
+            return
+        basic_time_step = float(time_step_match.group(1))
+        # the player expects a frame every basicTimeStep, so the frames are kept at a multiple of it
+        factor = max(round(sample_period / basic_time_step), 1) if sample_period else 1
+        time_step = basic_time_step * factor
+        time_step = int(time_step) if time_step.is_integer() else time_step
+        header = buffer[:start + 1]
+        if factor > 1:
+            header = header[:time_step_match.start(1)] + str(time_step) + header[time_step_match.end(1):]
+        destination.write(header)
+        position = start + 1
+        decoder = json.JSONDecoder()
+        pending = {}  # changes of the frames skipped since the last written frame, by key and node id
+        written = {}  # last written value of the fields, by key and node id
+        index = 0
+        count = 0
+        last_time = None
+        trailer = None
+        while trailer is None:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                trailer = buffer[position:]
+                break
+            try:
+                frame, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = source.read(ANIMATION_READ_SIZE)
+                if not chunk:  # truncated animation, e.g. if Webots was killed
+                    trailer = ']}'
+                    break
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            _merge_frame(pending, frame)
+            if index % factor == 0:
+                last_time = frame['time']
+                count = _write_frame(destination, last_time, pending, written, delta, count)
+            index += 1
+        if any(pending.values()) and last_time is not None:  # the last changes are shown one sample period later
+            _write_frame(destination, last_time + time_step, pending, written, delta, count)
+        destination.write(trailer + source.read())
+    os.replace(filename + '.tmp', filename)
+
+
+def _merge_frame(pending, frame):
+    # the lists of a frame (poses, labels) contain objects identified by their id, whose other keys are updated values
+    for key, items in frame.items():
+        if not isinstance(items, list):
+            continue
+        nodes = pending.setdefault(key, {})
+        for item in items:
+            if isinstance(item, dict) and 'id' in item:
+                nodes.setdefault(item['id'], {}).update(item)
+
+
+def _write_frame(destination, time, pending, written, delta, count):
+    frame = {'time': time}
+    for key, nodes in pending.items():
+        values = written.setdefault(key, {})
+        items = []
+        for id, item in nodes.items():
+            last = values.setdefault(id, {})
+            fields = {field: value for field, value in item.items()
+                      if field != 'id' and (not delta or last.get(field) != value)}
+            last.update(fields)
+            if fields:
+                items.append({'id': id, **fields})
+        frame[key] = items
+    pending.clear()
+    destination.write((',\n' if count else '\n') + json.dumps(frame, separators=(',', ':'), ensure_ascii=False))
+    return count + 1
+
+
+def _get_container_ids(match, role, created=False):  # created containers are only listed if created is set
+    return docker_engine.container_ids(match.labels(role), created)
+
+
+def prebuild_controller_image(role, controller_path, cpuset_cpus=None, background=False):
+    '''Silently build the cached image of a controller ahead of its game, return True if the image is available.
+
+    A background build runs on the given CPUs, or with a low CPU priority if it shares them with the running game.'''
+
+    tag = image_cache.controller_tag(controller_path, role)
+    if tag is None:  # the image would not be found by the game
+        return False
+    if not image_cache.exists(tag):
+        command_line = ['docker', 'build']
+        if cpuset_cpus:
+            command_line += [f'--cpuset-cpus={cpuset_cpus}']
+        elif background:
+            command_line += [f'--cpu-shares={BACKGROUND_CPU_SHARES}']
+        # errors are reported by the build of the game
+        with timing.span('build', image=tag, role=role, prefetch=True):
+            return_code = subprocess.run(command_line + _get_build_arguments(tag, role, controller_path),
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+        if return_code != 0:
+            return False
+    image_cache.touch(tag)
+    return True
+
+
+def _get_build_arguments(tag, role, controller_path):
+    return [
+        '--tag', tag,
+        '--file', f'{controller_path}/controllers/Dockerfile',
+        '--build-arg', f'WEBOTS_CONTROLLER_URL={role}',
+        f'{controller_path}/controllers'
+    ]
+
+
+def _build_controller_image(match, role, controller_path, name):
+    # controller images are tagged by the digest of their build context, so that unchanged controllers are not rebuilt
+    tag = image_cache.controller_tag(controller_path, role)
+    if tag is not None and image_cache.exists(tag):
+        print(f'Using cached {role} docker image {tag} ({name})')
+        image_cache.touch(tag)
+        match.images[role] = tag
+        return True
+    color = '31' if role == 'participant' else '34'
+    print(f'::group::Building \033[{color}m{role}\033[0m docker (\033[{color}m{name}\033[0m)')
+    with timing.span('build', image=tag if tag is not None else match.image(role), role=role, controller=name):
+        build = subprocess.Popen(
+            ['docker', 'build'] + _get_build_arguments(tag if tag is not None else match.image(role), role,
+                                                       controller_path),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding='utf-8'
+        )
+        return_code = _get_realtime_stdout(build)
+    print('::endgroup::')
+    if return_code != 0:
+        match.images.pop(role, None)
+        return False
+    if tag is None:
+        match.images[role] = match.image(role)
+    else:
+        image_cache.touch(tag)
+        match.images[role] = tag
+    return True
 
 
 def _get_realtime_stdout(process):
@@ -309,15 +751,33 @@ def _get_realtime_stdout(process):
     return process.returncode
 
 
-def _close_containers():  # clearing containers possibly remaining after the last job
-    webots_container_id = _get_container_id('recorder-webots')
-    if webots_container_id != '':  # Closing Webots with SIGINT to trigger animation export
-        subprocess.run(['docker', 'exec', webots_container_id, 'pkill', '-SIGINT', 'webots-bin'])
-    participant_controller_container_id = _get_container_id('participant-controller')
-    if participant_controller_container_id != '':
-        subprocess.run(
-            ['docker', 'kill', participant_controller_container_id], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    opponent_controller_container_id = _get_container_id('opponent-controller')
-    if opponent_controller_container_id != '':
-        subprocess.run(
-            ['docker', 'kill', opponent_controller_container_id], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def _close_containers(match, quit_webots=True):  # clearing the containers of the match possibly remaining after the game
+    webots_container_ids = _get_container_ids(match, 'webots') if quit_webots else []
+    for container_id in webots_container_ids:  # Closing Webots with SIGINT to trigger animation export
+        docker_engine.signal_process(container_id, 'webots-bin', 'SIGINT')
+    # the controller containers created ahead of the game may never have been started
+    docker_engine.remove(_get_container_ids(match, 'participant', True) + _get_container_ids(match, 'opponent', True))
+
+
+def _wait_for_webots(match, webots, multiplexer):  # the animation is complete once Webots has quit
+    deadline = time.time() + WEBOTS_QUIT_TIMEOUT
+    while multiplexer.is_open('webots') and time.time() < deadline:  # the output is drained until Webots quits
+        multiplexer.poll(1)
+    try:
+        # the removal of the container is awaited through the Docker Engine API, the docker CLI then exits right away
+        docker_engine.wait(match.name('webots'), timeout=max(deadline - time.time(), WATCHDOG_PERIOD))
+        webots.wait(timeout=max(deadline - time.time(), WATCHDOG_PERIOD))
+    except (TimeoutError, subprocess.TimeoutExpired):
+        print('::warning ::Webots did not quit after exporting the animation')
+        docker_engine.kill(match.name('webots'))
+        webots.kill()
+
+
+def _read_simulated_time(match):
+    filename = os.path.join(match.output_directory, SIMULATED_TIME_FILE)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        simulated_time = float(f.read().strip())
+    os.remove(filename)  # a stale value should not be reported for the next game
+    return simulated_time
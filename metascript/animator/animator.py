@@ -15,10 +15,15 @@
 # limitations under the License.
 
 import argparse
+import json
+import os
 import time
 from controller import Supervisor
 
-CONTROLLER_WAITING_TIME = 2
+COMMAND_POLLING_PERIOD = 0.01
+HEARTBEAT_PERIOD = 10  # seconds, the action considers Webots as stuck if it doesn't print anything for too long
+
+_runtime_files = {}  # original content of the runtime.ini file of each controller of the world
 
 
 def main():
@@ -27,30 +32,112 @@ def main():
                         help='Duration of the animation in seconds')
     parser.add_argument('--output', default='storage',
                         help='Path at which the animation will be saved')
+    parser.add_argument('--warm', action='store_true',
+                        help='Wait for commands to reset the world and record the next game after each game')
+    parser.add_argument('--mode', choices=['realtime', 'fast'], default='realtime',
+                        help='Simulation mode while recording the game')
+    parser.add_argument('--connection-timeout', type=float, default=60,
+                        help='Time in seconds after which the game starts even if the controllers are not connected')
     args = parser.parse_args()
+    command_file = f'../../{args.output}/animator.command'
 
     supervisor = Supervisor()
     timestep = int(supervisor.getBasicTimeStep())
 
-    # Wait for the controller to connect and start the animation
-    supervisor.simulationSetMode(supervisor.SIMULATION_MODE_PAUSE)
-    time.sleep(CONTROLLER_WAITING_TIME)
-    supervisor.simulationSetMode(supervisor.SIMULATION_MODE_REAL_TIME)
-    supervisor.animationStartRecording(f'../../{args.output}/animation.html')
+    while True:
+        # Wait for the controllers to connect and start the animation, the action sends a start command once they are
+        supervisor.simulationSetMode(supervisor.SIMULATION_MODE_PAUSE)
+        deadline = time.time() + args.connection_timeout
+        while _read_command(command_file) != 'start' and time.time() < deadline:
+            time.sleep(COMMAND_POLLING_PERIOD)
+        supervisor.simulationSetMode(supervisor.SIMULATION_MODE_FAST if args.mode == 'fast'
+                                     else supervisor.SIMULATION_MODE_REAL_TIME)
+        supervisor.animationStartRecording(f'../../{args.output}/animation.html')
+
+        # Time out detection loop
+        step_max = 1000 * args.duration / timestep
+        step_counter = 0
+        command = None
+        running = True
+        heartbeat = time.time()
 
-    # Time out detection loop
-    step_max = 1000 * args.duration / timestep
-    step_counter = 0
+        while running:
+            if supervisor.step(timestep) == -1:
+                running = False
+                break
+            if time.time() - heartbeat > HEARTBEAT_PERIOD:
+                print('Animator heartbeat', flush=True)
+                heartbeat = time.time()
+            # Stops the simulation if the controller takes too much time
+            step_counter += 1
+            if step_counter >= step_max:
+                break
+            if args.warm:  # the game may have ended with a performance reported by the world
+                command = _read_command(command_file)
+                if command == 'stop':
+                    break
 
-    while supervisor.step(timestep) != -1:
-        # Stops the simulation if the controller takes too much time
-        step_counter += 1
-        if step_counter >= step_max:
+        # If the time is up, stop recording and signal script to close Webots
+        with open(f'../../{args.output}/simulated_time', 'w') as f:  # reported in the timing of the game
+            f.write(str(supervisor.getTime()))
+        supervisor.animationStopRecording()
+        if command != 'stop':
+            print('Controller timeout')
+        if not args.warm or not running:
             break
 
-    # If the time is up, stop recording and signal script to close Webots
-    supervisor.animationStopRecording()
-    print('Controller timeout')
+        # Wait for the next game, the simulation is blocked as long as the animator does not step
+        if supervisor.step(timestep) == -1:  # let Webots export the animation
+            break
+        print('Animation saved')
+        while command is None or command.split(' ', 1)[0] != 'reset':
+            time.sleep(COMMAND_POLLING_PERIOD)
+            command = _read_command(command_file)
+            if command == 'stop':  # the game ended with a timeout and the animation was already saved
+                print('Animation saved')
+        # the reset command gives the environment variables of the next game, e.g. the names of its controllers
+        environment = json.loads(command.split(' ', 1)[1]) if ' ' in command else {}
+        supervisor.simulationReset()
+        _restart_controllers(supervisor, environment)
+
+
+def _read_command(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        command = f.read().strip()
+    os.remove(filename)
+    return command
+
+
+def _restart_controllers(supervisor, environment):
+    # the controllers are not restarted by a simulation reset, the extern controllers will wait for a new connection
+    children = supervisor.getRoot().getField('children')
+    animator_id = supervisor.getSelf().getId()
+    for i in range(children.getCount()):
+        node = children.getMFNode(i)
+        if node.getBaseTypeName() == 'Robot' and node.getId() != animator_id:
+            controller = node.getField('controller').getSFString()
+            if controller not in ['<extern>', '<none>', '']:
+                _set_controller_environment(controller, environment)
+            node.restartController()
+
+
+def _set_controller_environment(controller, environment):
+    # the environment of Webots is the one of the first game, the variables of the next games are given to the
+    # controllers of the world through their runtime.ini file, which is read by Webots when it starts a controller
+    filename = os.path.join('..', controller, 'runtime.ini')
+    if controller not in _runtime_files:
+        if os.path.exists(filename):
+            with open(filename) as f:
+                _runtime_files[controller] = f.read()
+        else:
+            _runtime_files[controller] = ''
+    with open(filename, 'w') as f:
+        f.write(_runtime_files[controller])
+        f.write('\n[environment variables for Linux]\n')
+        for variable, value in environment.items():
+            f.write(f'{variable} = {value}\n')
 
 
 if __name__ == '__main__':
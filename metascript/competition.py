@@ -14,20 +14,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 import json
 import os
 import re
 import requests
 import shutil
+import statistics
 import subprocess
 import sys
-from .animation import record_animations, TMP_ANIMATION_DIRECTORY
-from .utils import git, webots_cloud
+import threading
+from .animation import (ANIMATOR_DIRECTORY, ANIMATOR_SOURCE_DIRECTORY, decimate_animation, prebuild_controller_image,
+                        prepare_webots, record_animations, webots_image_tag)
+from .match import Match, run_matches
+from .participants import ParticipantsStore
+from .utils import cache, compression, cpu, git, image_cache, timing, webots_cloud
+from .utils.match_cache import MatchCache, MatchJournal, competition_digest
 
 # YAML booleans are converted to strings by GitHub composite Actions, so we need to convert them back to booleans
 UPLOAD_PERFORMANCE = re.search(r"^(?:y|Y|yes|Yes|YES|true|True|TRUE|on|On|ON)$", os.environ['UPLOAD_PERFORMANCE'])
 OPPONENT_REPO_NAME = os.environ['OPPONENT_REPO_NAME']
+AGGREGATIONS = ['mean', 'median', 'best']
+AGGREGATION_DIGITS = 6  # the aggregated performances are rounded to hide the floating point errors
+PREFETCH_NICENESS = 10  # priority of the threads prefetching opponents, inherited by their git processes
+INITIAL_RATING = 1500  # Elo rating of a new participant
+RATING_K_FACTOR = 32  # maximum change of a rating after a game
 
 
 class Participant:
@@ -37,7 +49,14 @@ class Participant:
         self.private = private
         self.controller_path = os.path.join('controllers', id)
         repo = 'https://{}:{}@github.com/{}'.format('Competition_Evaluator', os.environ['REPO_TOKEN'], self.repository)
-        if git.clone(repo, self.controller_path):
+        mirror = os.path.join(cache.directory('repositories'), self.repository.replace('/', '_') + '.git')
+        with timing.span('clone', repository=self.repository):
+            cloned = git.clone(repo, self.controller_path, mirror)
+        self.commit = git.head(self.controller_path) if cloned else None
+        # participant.json can be changed without changing the behavior of the controller
+        self.tree = git.tree_digest(self.controller_path, 'controllers',
+                                    ['controllers/participant/participant.json']) if cloned else None
+        if cloned:
             self.data = _load_json(os.path.join(self.controller_path, 'controllers', 'participant', 'participant.json'))
             if self.data:  # sanity checks
                 url = f'https://github.com/{repository}/blob/main/controllers/participant/participant.json'
@@ -71,6 +90,46 @@ class Participant:
             self.log = os.environ['LOG_URL']
 
 
+class OpponentPrefetcher:
+    '''Clone the next opponents and build their images in the background while the current game is running.'''
+
+    def __init__(self, count, cpuset_cpus=None):
+        self.count = count
+        self.cpuset_cpus = cpuset_cpus  # cores left unused by the pinning of the games, if any
+        self.executor = ThreadPoolExecutor(max_workers=count) if count > 0 else None
+        self.futures = {}
+
+    def prefetch(self, opponents):
+        if self.executor is None:
+            return
+        for o in opponents[:self.count]:
+            if o['id'] not in self.futures:
+                self.futures[o['id']] = self.executor.submit(self._fetch, o)
+
+    def get(self, o):
+        future = self.futures.pop(o['id'], None)
+        if future is not None:
+            return future.result()
+        return Participant(o['id'], o['repository'], o['private'], True)
+
+    def shutdown(self):  # remove the opponents which were prefetched but not played
+        if self.executor is None:
+            return
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for future in self.futures.values():
+            if not future.cancelled() and future.exception() is None and os.path.isdir(future.result().controller_path):
+                shutil.rmtree(future.result().controller_path)
+        self.futures = {}
+
+    def _fetch(self, o):
+        if self.cpuset_cpus is None:  # the clones and builds share the CPUs of the running game with a low priority
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICENESS)
+        opponent = Participant(o['id'], o['repository'], o['private'], True)
+        if opponent.data is not None:
+            prebuild_controller_image('opponent', opponent.controller_path, self.cpuset_cpus, True)
+        return opponent
+
+
 def competition(config):
     # Determine if GPU acceleration is available (typically on a self-hosted runner)
     if shutil.which('nvidia-docker'):
@@ -85,8 +144,9 @@ def competition(config):
     git.init()
 
     response = requests.get(
-        f'https://webots.cloud/storage/competition/{os.environ["GITHUB_REPOSITORY"]}/participants.json')
+        f'{webots_cloud.WEBOTS_CLOUD_URL}/storage/competition/{os.environ["GITHUB_REPOSITORY"]}/participants.json')
     open("participants.json", "wb").write(response.content)
+    participants = ParticipantsStore('participants.json')
 
     # Parse input participant
     participant = _get_participant()
@@ -95,118 +155,430 @@ def competition(config):
               + f'https://github.com/{participant.repository}/blob/main/controllers/participant/participant.json, '
               + 'please provide or fix this file.')
         sys.exit(1)
+    # the competition side of the evaluation: the Webots image (world, referee, animator) and the world settings
+    versus = config['world']['metric'] in ['ranking', 'rating']
+    competition_key = competition_digest(config['world'], webots_image_tag(config, versus))
+    p = participants.get(participant.id)
+    if not OPPONENT_REPO_NAME and p is not None and participant.tree is not None and p.get('tree') == participant.tree \
+            and p.get('competition') == competition_key:
+        print(f'::notice ::The controllers of {participant.repository} and the competition did not change since their '
+              + 'last evaluation, only the participant data are updated')
+        participant.log = None  # the log and the date of the last evaluation are kept
+        _update_participant(p, participant)
+        journal = MatchJournal()
+        failure = False
+    else:
+        # the games decided by an interrupted job of the participant are replayed from its journal
+        journal_enabled = config['world']['match-journal'] if 'match-journal' in config['world'] else True
+        journal_name = f'{os.environ["GITHUB_REPOSITORY"]}_{participant.id}'.replace('/', '_')
+        journal = MatchJournal(journal_name if journal_enabled and not OPPONENT_REPO_NAME else None)
+        failure = _evaluate(gpu, config, participants, participant, journal)
+        p = participants.get(participant.id)
+        if not OPPONENT_REPO_NAME and p is not None:
+            if not failure and p.get('performance') != -1:  # the evaluated controllers are recorded
+                p['commit'] = participant.commit
+                p['tree'] = participant.tree
+                p['competition'] = competition_key
+            else:  # a failed evaluation is played again on resubmission
+                p.pop('commit', None)
+                p.pop('tree', None)
+                p.pop('competition', None)
+    shutil.rmtree(participant.controller_path)
+    participants.save()
+
+    uploaded = True
+    if UPLOAD_PERFORMANCE:
+        method = config['world']['animation-compression'] if 'animation-compression' in config['world'] else 'none'
+        if method != 'none':
+            print('::warning ::The compressed animations are not supported yet by the viewer of webots.cloud '
+                  + '(animation-compression in webots.yml)')
+        files = [('participants.json', 'participants', 'participants.json')]
+        if os.path.isdir('storage'):
+            for f in sorted(os.listdir('storage')):
+                for animation in os.listdir(os.path.join('storage', f)):  # animation.json, possibly compressed
+                    path = os.path.join(f, animation)
+                    files.append((path, 'animation', os.path.join('storage', path)))
+        uploader = webots_cloud.Uploader(os.environ['GITHUB_REPOSITORY'], os.environ['REPO_TOKEN'])
+        if uploader.upload(files):
+            failure = True
+            uploaded = False  # a retry of the job replays the journal
+    if uploaded:  # the job is complete
+        journal.remove()
+    openmetrics = config['world']['timing-openmetrics'] if 'timing-openmetrics' in config['world'] else False
+    timing.write_report('timing.json', openmetrics)
+    if failure:
+        sys.exit(1)
+
+
+def _evaluate(gpu, config, participants, participant, journal):
+    # run the games of the participant and update the participants accordingly, return True in case of failure
     performance = None
     animator_controller_destination_path = _copy_animator_files()
+    prefetch = config['world']['prefetch'] if 'prefetch' in config['world'] else 0
+    if OPPONENT_REPO_NAME:
+        prefetch = 0
+    cpusets, spare_cpuset = cpu.allocate(config['world'], 1, 1 if prefetch else 0)  # a core unused by the game
+    match = Match(0, cpusets[0])
+    prefetcher = OpponentPrefetcher(prefetch, spare_cpuset)
+    match_cache = MatchCache(config['world'],
+                             config['world']['match-cache'] if 'match-cache' in config['world'] else 'none',
+                             webots_image_tag(config, True))
     failure = False
-    if config['world']['metric'] == 'ranking':  # run a bubble sort ranking
+    ranking_search = config['world']['ranking-search'] if 'ranking-search' in config['world'] else 'bubble'
+    if config['world']['metric'] == 'rating':
+        failure = _rating_tournament(gpu, config, participants, participant, match_cache, journal)
+    elif config['world']['metric'] == 'ranking' and ranking_search in ['binary', 'galloping'] and not OPPONENT_REPO_NAME:
+        failure = _ranking_search(gpu, config, participants, participant, match, prefetcher, match_cache, journal,
+                                  ranking_search == 'galloping')
+    elif config['world']['metric'] == 'ranking':  # run a bubble sort ranking
+        if ranking_search != 'bubble':
+            print(f'::warning ::Unsupported ranking search: {ranking_search} (ranking-search in webots.yml)')
+        first_run = True
         while True:
-            opponent = _get_opponent(participant)
+            opponent = _get_opponent(participants, participant, prefetcher)
             if opponent is None:  # we reached the top of the ranking
                 if OPPONENT_REPO_NAME:
                     print(f'::error ::Specified opponent was not found: {OPPONENT_REPO_NAME}')
                     break
                 if performance is None:  # number 1 was modified, so no performance evaluation was run
                     # we still need to update the participant data in case they were modified
-                    participants = _load_participants()
-                    if len(participants) == 0:  # number 1 is the first one to be submitted
+                    p = participants.get(participant.id)
+                    if p is None:  # number 1 is the first one to be submitted
                         p = {}
-                        _update_participant(p, participant, 1)
-                        participants['participants'].append(p)
-                    else:  # number 1 was updated
-                        for p in participants['participants']:
-                            if p['id'] == participant.id:
-                                _update_participant(p, participant, 1)
-                    _save_participants(participants)
+                        participants.append(p)
+                    _update_participant(p, participant, 1)
+                    participants.reindex()
                 break
-            performance = int(record_animations(gpu, config, participant.controller_path, participant.data['name'],
-                                                opponent.controller_path, opponent.data['name'],
-                                                True if performance is None else False))
+            performance, played = _play_game(gpu, config, participant, opponent, first_run, match, match_cache,
+                                             journal)
+            if played:
+                first_run = False
             if performance == -1:
                 failure = True
             elif performance == 1:
                 opponent.log = os.environ['LOG_URL']
             if OPPONENT_REPO_NAME:
-                _update_friendly_game(performance, participant, opponent)
+                _update_friendly_game(participants, performance, participant, opponent)
             else:
-                _update_ranking(performance, participant, opponent)
-            _update_animation_files(participant if OPPONENT_REPO_NAME or performance != 1 else opponent)
+                _update_ranking(participants, performance, participant, opponent)
+            _update_animation_files(participant if OPPONENT_REPO_NAME or performance != 1 else opponent, match, config)
             shutil.rmtree(opponent.controller_path)
             if performance != 1 or OPPONENT_REPO_NAME:  # draw, loose or friendly game: stop evaluations
                 break
+    elif 'runs' in config['world'] or 'seeds' in config['world']:  # several runs of a performance evaluation
+        failure = _evaluate_runs(gpu, config, participants, participant)
     else:  # run a simple performance evaluation
-        performance = record_animations(gpu, config, participant.controller_path, participant.data['name'])
+        performance = record_animations(gpu, config, participant.controller_path, participant.data['name'], match=match)
         higher_is_better = config['world']['higher-is-better'] if 'higher-is-better' in config['world'] else True
-        _update_performance(performance, participant, higher_is_better)
-        _update_animation_files(participant)
-    shutil.rmtree(participant.controller_path)
+        _update_performance(participants, performance, participant, higher_is_better)
+        _update_animation_files(participant, match, config)
+    prefetcher.shutdown()
+    match.close()
     shutil.rmtree(animator_controller_destination_path)
 
-    # cleanup docker containers, images and networks not used in the last 30 days
+    # evict the least recently used controller images above the cache size, in GB
+    image_cache_size = config['world']['image-cache-size'] if 'image-cache-size' in config['world'] else 20
+    image_cache.evict(image_cache_size * 1024 ** 3)
+    match_cache_size = config['world']['match-cache-size'] if 'match-cache-size' in config['world'] else 5
+    match_cache.evict(match_cache_size * 1024 ** 3)
+    # cleanup docker containers, networks and dangling images not used in the last 30 days, this keeps tagged images
     subprocess.check_output(['docker', 'system', 'prune', '--force', '--filter', 'until=720h'])
-
-    if UPLOAD_PERFORMANCE:
-        webots_cloud.upload_file(os.environ['GITHUB_REPOSITORY'], os.environ['REPO_TOKEN'], 'participants.json', 'participants')
-        if os.path.isdir('storage'):
-            os.chdir('storage')
-            for f in os.listdir('.'):
-                if f == '.' or f == '..':
-                    continue
-                filename = os.path.join(f, 'animation.json')
-                webots_cloud.upload_file(os.environ['GITHUB_REPOSITORY'], os.environ['REPO_TOKEN'], filename, 'animation')
-            os.chdir('..')
-    if failure:
-        sys.exit(1)
+    return failure
 
 
-def _get_opponent(participant):
-    participants = _load_participants()
-    if len(participants['participants']) == 0:
+def _evaluate_runs(gpu, config, participants, participant):
+    # run several evaluations concurrently on disjoint cpusets, possibly with seeds, and aggregate their performances,
+    # return True in case of failure
+    world_config = config['world']
+    seeds = world_config['seeds'] if 'seeds' in world_config else None
+    runs = world_config['runs'] if 'runs' in world_config else len(seeds)
+    if seeds is not None and len(seeds) != runs:
+        print(f'::error ::{len(seeds)} seeds are given for {runs} runs (seeds and runs in webots.yml)')
+        sys.exit(1)
+    aggregation = world_config['aggregation'] if 'aggregation' in world_config else 'mean'
+    if aggregation not in AGGREGATIONS:
+        print(f'::warning ::Unsupported aggregation: {aggregation} (aggregation in webots.yml), using mean')
+        aggregation = 'mean'
+    jobs = world_config['parallel-runs'] if 'parallel-runs' in world_config else runs
+    higher_is_better = world_config['higher-is-better'] if 'higher-is-better' in world_config else True
+
+    # the images are built once, before the runs
+    prepare_webots(config)
+    prebuild_controller_image('participant', participant.controller_path)
+    runs_directory = os.path.join('tmp', 'runs')
+    shutil.rmtree(runs_directory, ignore_errors=True)
+
+    def run(i):
+        def game(match):
+            performance = record_animations(gpu, config, participant.controller_path, participant.data['name'],
+                                            first_run=False, match=match, seed=seeds[i] if seeds else None)
+            animation = os.path.join(match.output_directory, 'animation.json')
+            if os.path.exists(animation):  # the slot is reused by the next run
+                os.makedirs(os.path.join(runs_directory, str(i)))
+                shutil.move(animation, os.path.join(runs_directory, str(i), 'animation.json'))
+            match.clear_output_directory()
+            return performance
+        return game
+
+    performances = run_matches([run(i) for i in range(runs)], world_config, min(jobs, runs))
+    for i, performance in enumerate(performances):
+        seed = f' (seed {seeds[i]})' if seeds else ''
+        print(f'Performance of run {i + 1}{seed}: {performance}')
+    performance, kept = _aggregate_performances(performances, aggregation, higher_is_better)
+    failed_runs = [str(i + 1) for i in range(runs) if performances[i] == -1]
+    if failed_runs:
+        print(f'::error ::{participant.data["name"]} failed in {len(failed_runs)} of {runs} runs '
+              + f'(run {", ".join(failed_runs)}), the evaluation fails')
+    else:
+        print(f'::notice ::The {aggregation} performance of {participant.data["name"]} over {runs} runs is: '
+              + f'{performance}')
+    _update_performance(participants, performance, participant, higher_is_better)
+    participants.get(participant.id)['runs'] = performances
+    if kept is not None:
+        animation = os.path.join(runs_directory, str(kept), 'animation.json')
+        if os.path.exists(animation):
+            _store_animation(participant, animation, config)
+    shutil.rmtree(runs_directory, ignore_errors=True)
+    return performance == -1
+
+
+def _aggregate_performances(performances, aggregation, higher_is_better):
+    # return the aggregated performance and the run whose animation is kept, a failed run fails the evaluation so that
+    # it cannot be rerolled away
+    if -1 in performances:
+        return -1, performances.index(-1)
+    runs = range(len(performances))
+    ranked = sorted(runs, key=lambda i: performances[i], reverse=higher_is_better)
+    if aggregation == 'best':
+        return performances[ranked[0]], ranked[0]
+    median = statistics.median(performances[i] for i in runs)
+    # the animation of the run closest to the median is kept
+    kept = min(runs, key=lambda i: abs(performances[i] - median))
+    aggregated = median if aggregation == 'median' else statistics.mean(performances[i] for i in runs)
+    return round(aggregated, AGGREGATION_DIGITS), kept
+
+
+def _get_opponent(participants, participant, prefetcher):
+    if len(participants) == 0:
         p = {}
         _update_participant(p, participant, 1)
-        participants['participants'].append(p)
-        _save_participants(participants)
+        participants.append(p)
         print(f'Welcome {participant.repository}, you are the first participant there')
         return None
 
     if OPPONENT_REPO_NAME:
-        for p in participants['participants']:
-            if p['repository'] == OPPONENT_REPO_NAME:
-                opponent = Participant(p['id'], p['repository'], p['private'], True)
-                if opponent.data is not None:
-                    return opponent
+        p = participants.get_by_repository(OPPONENT_REPO_NAME)
+        if p is not None:
+            opponent = Participant(p['id'], p['repository'], p['private'], True)
+            if opponent.data is not None:
+                return opponent
         return None
 
-    i = 0
-    found = False
-    for p in participants['participants']:
-        if p['id'] == participant.id:
-            found = True
-            break
-        i += 1
-    if i == 0 and found:
+    i = participants.index(participant.id)
+    if i == 0:
         print(f'{participant.repository} is number 1 in the ranking')
         return None
-    if not found:
+    if i is None:
         print(f'Welcome {participant.repository} and good luck for the competition')
+        i = len(participants)
     while i > 0:
-        o = participants['participants'][i - 1]
+        o = participants[i - 1]
         print(f'Cloning \033[34mopponent\033[0m repository: {o["repository"]}')
-        opponent = Participant(o['id'], o['repository'], o['private'], True)
+        opponent = prefetcher.get(o)
         if opponent.data is not None:
+            # the next opponents up the ranking are cloned and built while this game is running
+            prefetcher.prefetch(participants.participants[max(i - 1 - prefetcher.count, 0):i - 1][::-1])
             return opponent
         print(f'{o["repository"]} is not participating any more, removing it')
-        del participants['participants'][i - 1]
-        max = len(participants['participants'])
-        j = i
-        while j < max:  # update performance of controllers below the one deleted
-            participants['participants'][j]['performance'] -= 1
+        participants.pop(i - 1)
+        n = len(participants)
+        j = i - 1
+        while j < n:  # update performance of controllers below the one deleted
+            participants[j]['performance'] -= 1
             j += 1
-        _save_participants(participants)
         i -= 1
     print(f'All opponents have left, {participant.repository} becomes number 1')
     return None
 
 
+def _ranking_search(gpu, config, participants, participant, match, prefetcher, match_cache, journal, galloping):
+    # place the participant in the ranking with a binary (or galloping) search over the participants ranked above it
+    position = participants.index(participant.id)
+    if position == 0 or len(participants) == 0:
+        if len(participants) == 0:
+            print(f'Welcome {participant.repository}, you are the first participant there')
+        else:
+            print(f'{participant.repository} is number 1 in the ranking')
+        _move_participant(participants, participant, 0)
+        return False
+    if position is None:
+        print(f'Welcome {participant.repository} and good luck for the competition')
+        position = len(participants)
+    failure = False
+    first_run = True
+    low = 0  # the participant lost against the opponent ranked just above low
+    high = position  # the participant won against the opponent ranked at high
+    step = 1
+    while low < high:
+        i = _get_search_index(low, high, step, galloping)
+        o = participants[i]
+        print(f'Cloning \033[34mopponent\033[0m repository: {o["repository"]}')
+        opponent = prefetcher.get(o)
+        if opponent.data is None:
+            print(f'{o["repository"]} is not participating any more, removing it')
+            participants.pop(i)
+            _renumber_participants(participants)
+            high -= 1
+            continue
+        # the next opponent depends on the result of this game, so the opponents of both outcomes are prefetched
+        next_opponents = []
+        if low < i:
+            next_opponents.append(participants[_get_search_index(low, i, step * 2, galloping)])
+        if i + 1 < high:
+            next_opponents.append(participants[_get_search_index(i + 1, high, step, False)])
+        prefetcher.prefetch(next_opponents)
+        performance, played = _play_game(gpu, config, participant, opponent, first_run, match, match_cache, journal)
+        if played:
+            first_run = False
+        if performance == 1:
+            opponent.log = os.environ['LOG_URL']
+            _update_participant(o, opponent)
+            high = i
+            step *= 2
+        else:
+            low = i + 1
+            galloping = False  # the participant lost, we now know the range and can bisect it
+        _update_animation_files(participant if performance != 1 else opponent, match, config)
+        shutil.rmtree(opponent.controller_path)
+        if performance == -1:  # the participant failed, it keeps the best rank it proved
+            failure = True
+            break
+    print(f'{participant.repository} is ranked {high + 1}')
+    _move_participant(participants, participant, high)
+    return failure
+
+
+def _play_game(gpu, config, participant, opponent, first_run, match, match_cache, journal):
+    # return the result of the game and whether it was played, the result of an identical game may be reused
+    animation = os.path.join(match.output_directory, 'animation.json')
+    game_key = match_cache.game_key(participant, opponent)
+    performance = journal.load(game_key, animation)
+    if performance is not None:
+        print(f'::notice ::{participant.data["name"]} {"won" if performance == 1 else "lost"} over '
+              + f'{opponent.data["name"]} (game decided by an interrupted job)')
+        return performance, False
+    key = match_cache.key(participant, opponent)
+    performance = match_cache.load(key, animation)
+    if performance is None:
+        performance = int(record_animations(gpu, config, participant.controller_path, participant.data['name'],
+                                            opponent.controller_path, opponent.data['name'], first_run, match))
+        played = True
+        if performance != -1:
+            match_cache.store(key, performance, animation)
+    else:
+        print(f'::notice ::{participant.data["name"]} {"won" if performance == 1 else "lost"} over '
+              + f'{opponent.data["name"]} (result of an identical game)')
+        played = False
+    if performance != -1:
+        journal.append(game_key, participant, opponent, performance, animation)
+    return performance, played
+
+
+def _rating_tournament(gpu, config, participants, participant, match_cache, journal):
+    # play the participant against all the other participants (or a sample of them) concurrently and update the Elo
+    # ratings as the results arrive, return True in case of failure
+    world_config = config['world']
+    if OPPONENT_REPO_NAME:  # a friendly game only records its result, the participant is neither enrolled nor rated
+        p = None
+        opponents = [o for o in participants if o['repository'] == OPPONENT_REPO_NAME]
+        if not opponents:
+            print(f'::error ::Specified opponent was not found: {OPPONENT_REPO_NAME}')
+    else:
+        p = participants.get(participant.id)
+        if p is None:
+            print(f'Welcome {participant.repository} and good luck for the competition')
+            p = {}
+            _update_participant(p, participant)
+            participants.append(p)
+        else:
+            _update_participant(p, participant)
+        opponents = [o for o in participants if o['id'] != participant.id]
+        count = world_config['rating-opponents'] if 'rating-opponents' in world_config else len(opponents)
+        if count < len(opponents):  # a sample spread over the whole ranking
+            opponents = [opponents[len(opponents) * i // count] for i in range(count)]
+        for entry in [p] + opponents:
+            entry.setdefault('rating', INITIAL_RATING)
+            entry.setdefault('games', 0)
+    k_factor = world_config['rating-k-factor'] if 'rating-k-factor' in world_config else RATING_K_FACTOR
+    cpus = world_config['cpus'] if 'cpus' in world_config else 1
+    jobs = world_config['parallel-games'] if 'parallel-games' in world_config \
+        else len(cpu.available()) // (2 * cpus + 1)  # as many games as the CPUs allow to pin
+    lock = threading.Lock()
+    failures = []
+    left = []
+
+    # the images are built once, before the games
+    prepare_webots(config, True)
+    prebuild_controller_image('participant', participant.controller_path)
+
+    def play(o):
+        def game(match):
+            print(f'Cloning \033[34mopponent\033[0m repository: {o["repository"]}')
+            opponent = Participant(o['id'], o['repository'], o['private'], True)
+            if opponent.data is None:
+                with lock:
+                    left.append(o)
+                return
+            performance, _ = _play_game(gpu, config, participant, opponent, False, match, match_cache, journal)
+            with lock:
+                if performance == -1:  # a failure of the participant is a loss
+                    failures.append(o)
+                if OPPONENT_REPO_NAME:
+                    _update_friendly_game(participants, performance, participant, opponent)
+                else:
+                    if performance == 1:
+                        opponent.log = os.environ['LOG_URL']
+                        _update_participant(o, opponent)
+                    _update_ratings(p, o, 1 if performance == 1 else 0, k_factor)
+                    print(f'Ratings: {participant.repository} {p["rating"]:.0f}, {o["repository"]} {o["rating"]:.0f}')
+                # the animation is stored in the folder of the loser, the participant may lose several concurrent games
+                _update_animation_files(participant if OPPONENT_REPO_NAME or performance != 1 else opponent, match,
+                                        config)
+            shutil.rmtree(opponent.controller_path)
+        return game
+
+    run_matches([play(o) for o in opponents], world_config, max(1, min(jobs, len(opponents))))
+    for o in left:
+        print(f'{o["repository"]} is not participating any more, removing it')
+        participants.pop(participants.index(o['id']))
+    if not OPPONENT_REPO_NAME:
+        _sort_by_rating(participants)
+        print(f'{participant.repository} is ranked {participants.index(participant.id) + 1} '
+              + f'with a rating of {p["rating"]:.0f}')
+    return len(failures) > 0
+
+
+def _update_ratings(p, o, score, k_factor):
+    # Elo ratings, the score of the participant p is 1 if it won and 0 if it lost against o
+    expected = 1 / (1 + 10 ** ((o['rating'] - p['rating']) / 400))
+    p['rating'] = round(p['rating'] + k_factor * (score - expected), 1)
+    o['rating'] = round(o['rating'] - k_factor * (score - expected), 1)
+    p['games'] += 1
+    o['games'] += 1
+
+
+def _sort_by_rating(participants):
+    # the performance of a participant is its rounded rating
+    participants.participants.sort(key=lambda p: p['rating'] if 'rating' in p else INITIAL_RATING, reverse=True)
+    for p in participants:
+        p['performance'] = round(p['rating']) if 'rating' in p else INITIAL_RATING
+    participants.reindex()
+
+
+def _get_search_index(low, high, step, galloping):
+    return max(high - step, low) if galloping else (low + high) // 2
+
+
 def _get_participant():
     print(f'Cloning \033[31mparticipant\033[0m repository: {os.environ["PARTICIPANT_REPO_NAME"]}')
     participant = Participant(
@@ -217,10 +589,8 @@ def _get_participant():
 
 
 def _copy_animator_files():
-    animator_controller_source = os.path.join('metascript', 'animator')
-    animator_controller_destination = os.path.join('controllers', 'animator')
-    shutil.copytree(animator_controller_source, animator_controller_destination)
-    return animator_controller_destination
+    shutil.copytree(ANIMATOR_SOURCE_DIRECTORY, ANIMATOR_DIRECTORY)
+    return ANIMATOR_DIRECTORY
 
 
 def _update_participant(p, participant, performance=None):
@@ -240,79 +610,71 @@ def _update_participant(p, participant, performance=None):
         p['performance'] = performance
 
 
-def _update_performance(performance, participant, higher_is_better):
-    # change the requested participant's performance and update list order
-    participants = _load_participants()
-    i = 0
-    found = False
-    for p in participants['participants']:
-        if p['id'] == participant.id:
-            found = True
-            break
+def _move_participant(participants, participant, i):
+    # insert or move the participant at the i-th rank and shift down the participants below it
+    j = participants.index(participant.id)
+    p = participants.pop(j) if j is not None else {}
+    _update_participant(p, participant)
+    participants.insert(i, p)
+    _renumber_participants(participants)
+
+
+def _renumber_participants(participants):
+    # in a ranking competition, the performance of a participant is its rank
+    i = 1
+    for p in participants:
+        p['performance'] = i
         i += 1
-    np = participants['participants'].pop(i) if found else {}
+
+
+def _update_performance(participants, performance, participant, higher_is_better):
+    # change the requested participant's performance and update list order
+    i = participants.index(participant.id)
+    np = participants.pop(i) if i is not None else {}
     _update_participant(np, participant, performance)
     i = 0
-    for p in participants['participants']:
+    for p in participants:
         if higher_is_better and performance > p['performance']:
             break
         elif not higher_is_better and performance < p['performance']:
             break
         i += 1
-    participants['participants'].insert(i, np)
-    _save_participants(participants)
+    participants.insert(i, np)
 
 
-def _update_friendly_game(performance, participant, opponent):
+def _update_friendly_game(participants, performance, participant, opponent):
     # set result and opponent name for a friendly game
-    participants = _load_participants()
-    opponent_name = None
-    for p in participants['participants']:
-        if p['id'] == opponent.id:
-            opponent_name = p['name']
-            break
-    if opponent_name is None:
+    o = participants.get(opponent.id)
+    if o is None:
         print('::error ::Could not find opponent in a friendly game')
         return
-    for p in participants['participants']:
-        if p['id'] == participant.id:
-            p['friend'] = {'name': opponent_name, 'result': 'W' if performance == 1 else 'L'}
-            break
-    _save_participants(participants)
+    p = participants.get(participant.id)
+    if p is not None:
+        p['friend'] = {'name': o['name'], 'result': 'W' if performance == 1 else 'L'}
 
 
-def _update_ranking(performance, participant, opponent):
+def _update_ranking(participants, performance, participant, opponent):
     # insert participant if new, and swap winning participant with opponent
-    participants = _load_participants()
-    found_participant = False
-    found_opponent = False
-    for p in participants['participants']:
-        if p['id'] == opponent.id:
-            found_opponent = p
-            if found_participant:
-                break
-        elif p['id'] == participant.id:
-            found_participant = p
-            if found_opponent:
-                break
-    if not found_opponent:
+    found_participant = participants.get(participant.id)
+    found_opponent = participants.get(opponent.id)
+    if found_opponent is None:
         print('::error ::Missing opponent in participants.json')
         sys.exit(1)
-    count = len(participants['participants']) + 1
+    count = len(participants) + 1
     if performance != 1:  # participant lost
         if found_participant:  # nothing to change, however, the participant.json data may have changed
             _update_participant(found_participant, participant)
-            _save_participants(participants)
             return
         # we need to add the participant at the bottom of the list
         p = {}
         _update_participant(p, participant, count)
-        participants['participants'].append(p)
+        participants.append(p)
     else:
         if found_participant:  # swap
             rank = found_opponent['performance']
             _update_participant(found_opponent, participant, rank)
             _update_participant(found_participant, opponent, rank + 1)
+            participants.reindex()
         else:  # insert participant at last but one position, move opponent to last position
             if found_opponent['performance'] != count - 1:
                 print('::error ::Opponent should be ranked last in participants.json '
@@ -321,19 +683,7 @@ def _update_ranking(performance, participant, opponent):
             _update_participant(found_opponent, opponent, count)
             p = {}
             _update_participant(p, participant, count - 1)
-            participants['participants'].insert(count - 2, p)
-    _save_participants(participants)
-
-
-def _load_participants():
-    participants = _load_json('participants.json')
-    if participants is None:
-        participants = {'participants': []}
-    return participants
-
-
-def _save_participants(participants):
-    _save_json('participants.json', participants)
+            participants.insert(count - 2, p)
 
 
 def _load_json(filename):
@@ -343,14 +693,23 @@ def _load_json(filename):
         return json.load(f)
 
 
-def _save_json(filename, object):
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(object, f, ensure_ascii=False, indent=2)
+def _update_animation_files(participant, match, config):
+    animation = os.path.join(match.output_directory, 'animation.json')
+    if os.path.exists(animation):  # no animation is recorded when the game could not be played
+        _store_animation(participant, animation, config)
+    match.clear_output_directory()
+    return
 
 
-def _update_animation_files(participant):
+def _store_animation(participant, animation, config):
     folder = os.path.join('storage', ('f' if OPPONENT_REPO_NAME else '') + participant.id)
+    if os.path.isdir(folder):  # a participant may lose several games during a ranking search
+        shutil.rmtree(folder)
     os.makedirs(folder)
-    shutil.copy(os.path.join(TMP_ANIMATION_DIRECTORY, 'animation.json'), os.path.join(folder, 'animation.json'))
-    shutil.rmtree(TMP_ANIMATION_DIRECTORY)
-    return
+    sample_period = config['world']['animation-sample-period'] if 'animation-sample-period' in config['world'] else None
+    delta = config['world']['animation-delta'] if 'animation-delta' in config['world'] else False
+    if sample_period or delta:
+        decimate_animation(animation, sample_period, delta)
+    # the animation may be very large, so it is moved or compressed as a stream rather than copied
+    method = config['world']['animation-compression'] if 'animation-compression' in config['world'] else 'none'
+    compression.move(animation, os.path.join(folder, 'animation.json'), compression.get_method(method))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import queue
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from .utils import cpu, docker_engine
+
+IPC_DIRECTORY = os.path.join('/tmp', 'webots-matches')
+LABEL = 'competition-record-action'
+WEBOTS_QUIT_TIMEOUT = 30  # seconds
+
+
+def _job_id():
+    # unique among the jobs sharing a docker host, a retry of a job reuses it to clean up the containers of its previous
+    # attempts, the pid identifies the job outside of GitHub Actions
+    if 'GITHUB_RUN_ID' in os.environ:
+        return re.sub(r'[^A-Za-z0-9_.-]', '-', f"{os.environ['GITHUB_RUN_ID']}-{os.environ.get('GITHUB_JOB', '')}")
+    return str(os.getpid())
+
+
+JOB_ID = _job_id()
+
+
+class Match:
+    '''Resources isolating a game from the other games running on the same host.
+
+    Each match slot has its own IPC directory, container names, labels and output directory, so
+    that several games can run concurrently. The resources shared by the docker host are also prefixed by the id of the
+    job, so that the games of concurrent jobs are isolated too. A slot is reused by the successive games scheduled on
+    it.'''
+
+    def __init__(self, slot=0, cpusets=None):
+        self.slot = slot
+        self.id = f'{JOB_ID}-{slot}'
+        self.ipc_directory = os.path.join(IPC_DIRECTORY, self.id)
+        self.output_directory = os.path.join('tmp', str(slot))
+        self.cpusets = cpusets  # cpuset of each role, None means the default CPU pinning, an empty dict means none
+        self.images = {}  # controller image used by each role
+        self.warm = False  # whether the warm Webots container of the match is running
+        self.webots = None  # process of the Webots instance running in the warm container
+        self.webots_seed = None  # seed of the running Webots instance, which may be read when the world is loaded
+
+    def clear_output_directory(self):
+        # the directory itself is kept as it may be mounted in the warm Webots container
+        for entry in os.listdir(self.output_directory):
+            path = os.path.join(self.output_directory, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def quit_webots(self):  # Closing Webots with SIGINT to trigger animation export
+        docker_engine.signal_process(self.name('webots'), 'webots-bin', 'SIGINT')
+        try:
+            self.webots.wait(timeout=WEBOTS_QUIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.webots.kill()
+        self.webots = None
+
+    def close(self):  # stop the warm Webots container, if any
+        if not self.warm:
+            return
+        if self.webots is not None:
+            self.quit_webots()
+        docker_engine.kill(self.name('webots'))
+        self.warm = False
+
+    def name(self, role):
+        return f'{role}-{self.id}'
+
+    def image(self, role):  # tag of the controller images which cannot be cached
+        return f'{role}-controller:{self.id}'
+
+    def ipc(self, role):
+        # the host IPC directory is mounted at the place where Webots expects it in the containers
+        return f'{os.path.join(self.ipc_directory, role)}:/tmp/webots/root/1234/ipc/{role}'
+
+    def labels(self, role):
+        return [f'{LABEL}.match={self.id}', f'{LABEL}.role={role}']
+
+
+def run_matches(games, world_config, jobs=1):
+    '''Run independent games concurrently, each game being a function taking a Match as argument.
+
+    The results are returned in the order of the games. A game should consume the output directory of its match before
+    returning, as the match slot is then reused by another game.'''
+
+    slots = queue.Queue()
+    cpusets, _ = cpu.allocate(world_config, jobs)  # each match gets its own cores
+    for slot in range(jobs):
+        slots.put(Match(slot, cpusets[slot]))
+
+    def run(game):
+        match = slots.get()
+        try:
+            return game(match)
+        finally:
+            slots.put(match)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(run, games))
+    finally:
+        while not slots.empty():
+            slots.get().close()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+
+class ParticipantsStore:
+    '''In-memory participants.json with id and repository indexes, written atomically once at the end of the job.'''
+
+    def __init__(self, filename='participants.json'):
+        self.filename = filename
+        self.data = None
+        if os.path.exists(filename):
+            with open(filename, encoding='utf-8') as f:
+                self.data = json.load(f)
+        if self.data is None:
+            self.data = {'participants': []}
+        self.participants = self.data['participants']
+        self._build_indexes()
+
+    def __len__(self):
+        return len(self.participants)
+
+    def __getitem__(self, i):
+        return self.participants[i]
+
+    def __iter__(self):
+        return iter(self.participants)
+
+    def index(self, id):
+        return self.ids.get(id)
+
+    def get(self, id):
+        i = self.ids.get(id)
+        return None if i is None else self.participants[i]
+
+    def get_by_repository(self, repository):
+        i = self.repositories.get(repository)
+        return None if i is None else self.participants[i]
+
+    def insert(self, i, p):
+        self.participants.insert(i, p)
+        self._build_indexes()
+
+    def append(self, p):
+        self.participants.append(p)
+        self._build_indexes()
+
+    def pop(self, i):
+        p = self.participants.pop(i)
+        self._build_indexes()
+        return p
+
+    def reindex(self):  # the id or repository of an entry was changed in place
+        self._build_indexes()
+
+    def save(self):
+        with open(self.filename + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(self.filename + '.tmp', self.filename)  # a crash cannot leave a partially written file
+
+    def _build_indexes(self):  # only needed when the list is reordered, lookups are then O(1)
+        self.ids = {}
+        self.repositories = {}
+        for i, p in enumerate(self.participants):
+            self.ids[p['id']] = i
+            self.repositories.setdefault(p['repository'], i)
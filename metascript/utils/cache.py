@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+# persistent cache kept across jobs on self-hosted runners
+CACHE_DIRECTORY = os.environ.get('CACHE_DIRECTORY') or os.path.join(os.path.expanduser('~'), '.cache',
+                                                                     'competition-record-action')
+
+
+def directory(*names):
+    path = os.path.join(CACHE_DIRECTORY, *names)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import os
+import shutil
+
+CHUNK_SIZE = 1024 * 1024
+EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for zstd compression
+    zstandard = None
+
+
+def get_method(method):
+    if method not in EXTENSIONS:
+        print(f'::warning ::Unsupported animation compression: {method}, using gzip')
+        return 'gzip'
+    if method == 'zstd' and zstandard is None:
+        print('::warning ::The zstandard python module is not installed, using gzip instead of zstd')
+        return 'gzip'
+    return method
+
+
+def move(source, destination, method='none'):
+    '''Move a file, compressing it chunk by chunk, and return the name of the destination file.'''
+
+    destination += EXTENSIONS[method]
+    if method == 'none':
+        shutil.move(source, destination)
+        return destination
+    with open(source, 'rb') as input:
+        if method == 'gzip':
+            with gzip.open(destination, 'wb') as output:
+                shutil.copyfileobj(input, output, CHUNK_SIZE)
+        else:
+            with open(destination, 'wb') as f, zstandard.ZstdCompressor().stream_writer(f) as output:
+                shutil.copyfileobj(input, output, CHUNK_SIZE)
+    os.remove(source)
+    return destination
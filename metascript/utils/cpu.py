@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import glob
+import os
+
+SYSFS_DIRECTORY = '/sys/devices/system'
+
+
+def available():
+    '''Return the logical CPUs the process is allowed to run on.'''
+
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # not available on all platforms
+        return list(range(os.cpu_count()))
+
+
+@functools.lru_cache()
+def topology():
+    '''Return the physical cores available to the process, each one as the list of its logical CPUs.
+
+    The cores are ordered by NUMA node, so that contiguous cores share the same memory.'''
+
+    cpus = available()
+    nodes = {}
+    for path in glob.glob(os.path.join(SYSFS_DIRECTORY, 'node', 'node[0-9]*', 'cpulist')):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        for cpu in _parse_list(_read(path)):
+            nodes[cpu] = node
+    cores = {}
+    for cpu in cpus:
+        siblings = _parse_list(_read(os.path.join(SYSFS_DIRECTORY, 'cpu', f'cpu{cpu}', 'topology',
+                                                  'thread_siblings_list')))
+        core = tuple(sibling for sibling in siblings if sibling in cpus) or (cpu,)
+        cores[core] = nodes.get(cpu, 0)
+    return [list(core) for core in sorted(cores, key=lambda core: (cores[core], core[0]))]
+
+
+def allocate(world_config, count=1, reserve=0):
+    '''Split the available CPUs between the Webots and controller containers of concurrent matches.
+
+    Returns a list of `count` dicts giving the cpuset of each role of a match, and the cpuset of `reserve` cores kept
+    for background tasks, or None if the matches would use them.'''
+
+    cpus = world_config['cpus'] if 'cpus' in world_config else 1
+    cores = topology()
+    if sum(len(core) for core in cores) < count:
+        print(f'::warning ::Not enough CPUs to pin {count} concurrent matches, the CPUs will not be pinned')
+        return [{} for _ in range(count)], None
+    if reserve and sum(len(core) for core in cores[:-reserve]) >= count * (2 * cpus + 1):
+        matches = _allocate_matches(cores[:-reserve], count, cpus)
+        # the cores are only reserved if they would be left unused by the pinning, never taken from Webots
+        if all(len(_parse_list(reserved['webots'])) >= len(_parse_list(unreserved['webots']))
+               for reserved, unreserved in zip(matches, _allocate_matches(cores, count, cpus))):
+            return matches, _format([cpu for core in cores[-reserve:] for cpu in core])
+    return _allocate_matches(cores, count, cpus), None
+
+
+def _allocate_matches(cores, count, cpus):
+    if len(cores) < count:  # the matches have to share physical cores
+        cores = [[cpu] for core in cores for cpu in core]
+    groups = []
+    for i in range(count):  # contiguous cores, so that a match stays on a NUMA node whenever possible
+        groups.append(cores[len(cores) * i // count:len(cores) * (i + 1) // count])
+    return [_allocate_match(group, cpus) for group in groups]
+
+
+def _allocate_match(cores, cpus):
+    # the controllers get whole physical cores when possible, so that they don't compete with each other through SMT,
+    # and Webots gets all the other CPUs, including the unused siblings of the controller cores
+    remaining = list(cores)
+    controllers = {}
+    for role in ['opponent', 'participant']:
+        controllers[role] = []
+        while remaining and len(controllers[role]) < cpus:
+            controllers[role] += remaining.pop()
+    if remaining and len(controllers['participant']) >= cpus:
+        webots = [cpu for core in remaining for cpu in core]
+        for role in controllers:
+            webots += controllers[role][cpus:]
+            controllers[role] = controllers[role][:cpus]
+    else:
+        logical = [cpu for core in cores for cpu in core]
+        if len(logical) > 2 * cpus:
+            webots = logical[:-2 * cpus]
+            controllers = {'participant': logical[-2 * cpus:-cpus], 'opponent': logical[-cpus:]}
+        else:  # the controllers share the CPUs not used by Webots
+            webots = logical[:1]
+            shared = logical[1:] or logical
+            controllers = {'participant': shared, 'opponent': shared}
+            if len(shared) < cpus:
+                print(f'::warning ::Only {len(logical)} CPUs available for a match, '
+                      + f'the controllers will get less than {cpus} CPUs (cpus in webots.yml)')
+    return {'webots': _format(webots), 'participant': _format(controllers['participant']),
+            'opponent': _format(controllers['opponent'])}
+
+
+def _format(cpus):
+    return ','.join(str(cpu) for cpu in sorted(cpus))
+
+
+def _parse_list(cpu_list):  # e.g. '0-3,8-11'
+    cpus = []
+    for interval in (cpu_list or '').split(','):
+        if '-' in interval:
+            first, last = interval.split('-')
+            cpus += range(int(first), int(last) + 1)
+        elif interval:
+            cpus.append(int(interval))
+    return cpus
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import http.client
+import json
+import os
+import socket
+import subprocess
+import threading
+import urllib.parse
+
+DOCKER_SOCKET = '/var/run/docker.sock'
+API_TIMEOUT = 30  # seconds
+POOL_SIZE = 4  # idle connections kept open
+
+_lock = threading.Lock()
+_client = None
+_client_checked = False
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Client:
+    '''Minimal client of the Docker Engine API over its unix socket, keeping a pool of persistent connections.'''
+
+    def __init__(self, socket_path, timeout=API_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(self, method, path, body=None):
+        '''Return the status and the decoded JSON (or raw) content of the response, raise OSError if it failed.'''
+
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        data = json.dumps(body) if body is not None else None
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            reused = connection is not None
+            if connection is None:
+                connection = _UnixHTTPConnection(self.socket_path, self.timeout)
+            try:
+                connection.request(method, path, data, headers)
+                response = connection.getresponse()
+                content = response.read()
+                break
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                if not reused:  # an idle connection may have been closed by the server, it is retried once
+                    raise OSError(f'Docker Engine API request failed: {method} {path}: {error}') from error
+        if response.will_close:
+            connection.close()
+        else:
+            with self._lock:
+                if len(self._idle) < POOL_SIZE:
+                    self._idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+        if content and response.getheader('Content-Type', '').startswith('application/json'):
+            content = json.loads(content)
+        return response.status, content
+
+    def close(self):
+        with self._lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle = []
+
+
+def client():
+    '''Return the client of the local Docker Engine, or None if the docker CLI has to be used.'''
+
+    global _client, _client_checked
+    with _lock:
+        if not _client_checked:
+            _client_checked = True
+            socket_path = _get_socket_path()
+            if socket_path is not None and os.path.exists(socket_path):
+                engine = Client(socket_path)
+                try:
+                    status, _ = engine.request('GET', '/_ping')
+                except OSError:
+                    status = None
+                if status == 200:
+                    _client = engine
+                else:
+                    engine.close()
+        return _client
+
+
+def container_ids(labels, created=False):
+    '''Return the ids of the running containers having all the labels, including the created ones if created is set.'''
+
+    filters = json.dumps({'label': labels})
+    response = _request('GET', f'/containers/json?all={int(created)}&filters={urllib.parse.quote(filters)}')
+    if response is not None and response[0] == 200:
+        return [container['Id'] for container in response[1]]
+    command_line = ['docker', 'ps', '-q'] + (['--all'] if created else [])
+    for label in labels:
+        command_line += ['--filter', f'label={label}']
+    return subprocess.check_output(command_line).decode('utf-8').split()
+
+
+def kill(container):
+    if _request('POST', f'/containers/{_quote(container)}/kill') is None:
+        subprocess.run(['docker', 'kill', container], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def remove(containers):  # containers are killed if they are running
+    for container in containers:
+        if _request('DELETE', f'/containers/{_quote(container)}?force=1') is None:
+            subprocess.run(['docker', 'rm', '--force', container], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+
+
+def wait(container, timeout=None):
+    '''Wait until a container is removed and return its exit code, or None if the Docker Engine API can't be used or
+    if the container doesn't exist. Raise TimeoutError if it is still there after timeout seconds.
+
+    The containers of the action are run with --rm, so that they are removed as soon as they exit.'''
+
+    engine = client()
+    if engine is None:
+        return None
+    # the request is pending until the container is removed, it gets its own connection which is not pooled
+    connection = _UnixHTTPConnection(engine.socket_path, timeout)
+    try:
+        connection.request('POST', f'/containers/{_quote(container)}/wait?condition=removed')
+        response = connection.getresponse()
+        content = response.read()
+        return json.loads(content)['StatusCode'] if response.status == 200 else None
+    except TimeoutError:
+        raise
+    except (OSError, http.client.HTTPException, ValueError, KeyError):
+        return None
+    finally:
+        connection.close()
+
+
+def signal_process(container, process, signal):
+    '''Send a signal, e.g. SIGINT, to the processes of a container with the given name.'''
+
+    command = ['pkill', f'-{signal}', process]
+    response = _request('POST', f'/containers/{_quote(container)}/exec', {'Cmd': command})
+    if response is not None and response[0] == 201:
+        if _request('POST', f'/exec/{response[1]["Id"]}/start', {'Detach': True}) is not None:
+            return
+    elif response is not None:  # the container is not running
+        return
+    subprocess.run(['docker', 'exec', container] + command)
+
+
+def image_size(tag):
+    '''Return the size of an image, or None if it doesn't exist.'''
+
+    response = _request('GET', f'/images/{_quote(tag)}/json')
+    if response is not None:
+        return response[1]['Size'] if response[0] == 200 else None
+    try:
+        size = subprocess.check_output(['docker', 'image', 'inspect', '--format', '{{.Size}}', tag],
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except subprocess.CalledProcessError:
+        return None
+    return int(size)
+
+
+def remove_image(tag):
+    if _request('DELETE', f'/images/{_quote(tag)}') is None:
+        subprocess.run(['docker', 'image', 'rm', tag], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _request(method, path, body=None):  # None if the docker CLI has to be used
+    engine = client()
+    if engine is None:
+        return None
+    try:
+        return engine.request(method, path, body)
+    except (OSError, ValueError) as error:
+        print(f'::warning ::{error}, using the docker CLI')
+        return None
+
+
+def _quote(name):
+    return urllib.parse.quote(name, safe=':/')
+
+
+def _get_socket_path():
+    host = os.environ.get('DOCKER_HOST')
+    if not host:
+        return DOCKER_SOCKET
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+    return None  # remote engines are left to the docker CLI
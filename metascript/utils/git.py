@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import os
 import subprocess
 
 
@@ -24,9 +26,51 @@ def init():
         subprocess.check_output(['git', 'config', '--global', 'user.email', '97463320+webots-cloud@users.noreply.github.com'])
 
 
-def clone(repo, path):
+def clone(repo, path, mirror=None):
+    if mirror is None:
+        try:
+            subprocess.check_output(['git', 'clone', '--depth=1', '-q', repo, path])
+            return True
+        except subprocess.CalledProcessError:
+            return False
+    # check out a worktree of a persistent bare mirror, which is only fetched when the remote HEAD has moved
     try:
-        subprocess.check_output(['git', 'clone', '--depth=1', '-q', repo, path])
+        head = subprocess.check_output(['git', 'ls-remote', repo, 'HEAD']).decode('utf-8').split()
+        if len(head) == 0:  # empty repository
+            return False
+        commit = head[0]
+        if not os.path.isdir(mirror):
+            subprocess.check_output(['git', 'init', '--bare', '-q', mirror])
+        if subprocess.run(['git', '-C', mirror, 'cat-file', '-e', f'{commit}^{{commit}}'],
+                          stderr=subprocess.DEVNULL).returncode != 0:
+            # the token is part of the URL, so it is passed to each fetch rather than stored as a remote
+            subprocess.check_output(['git', '-C', mirror, 'fetch', '--depth=1', '-q', repo, 'HEAD'])
+        subprocess.check_output(['git', '-C', mirror, 'update-ref', 'refs/heads/main', commit])  # keep it from gc
+        subprocess.check_output(['git', '-C', mirror, 'worktree', 'prune'])  # worktrees removed with shutil.rmtree
+        subprocess.check_output(['git', '-C', mirror, 'worktree', 'add', '--detach', '--force', '-q',
+                                 os.path.abspath(path), commit])
         return True
     except subprocess.CalledProcessError:
         return False
+
+
+def head(path):
+    try:
+        return subprocess.check_output(['git', '-C', path, 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def tree_digest(path, directory, excluded=[]):
+    '''Return a digest of the files of a directory at HEAD, ignoring the excluded files, or None if there is none.'''
+
+    try:
+        files = subprocess.check_output(['git', '-C', path, 'ls-tree', '-r', 'HEAD', '--', directory],
+                                        stderr=subprocess.DEVNULL).decode('utf-8').splitlines()
+    except subprocess.CalledProcessError:
+        return None
+    files = [f for f in files if f.split('\t', 1)[-1] not in excluded]  # mode, type and blob hash, then the path
+    if not files:
+        return None
+    return hashlib.sha256('\n'.join(files).encode('utf-8')).hexdigest()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from . import cache, docker_engine
+
+IMAGE_REPOSITORY = 'competition-controller'
+WEBOTS_IMAGE_REPOSITORY = 'recorder-webots'
+
+_lock = threading.Lock()
+_used = set()  # images used by the current job, they are never evicted
+
+
+def controller_tag(controller_path, role):
+    '''Return a tag identifying the content of the build context of a controller, or None if it cannot be computed.'''
+
+    try:  # the tree hash of the build context covers the Dockerfile and all the files copied in the image
+        tree = subprocess.check_output(['git', '-C', controller_path, 'rev-parse', 'HEAD:controllers'],
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except subprocess.CalledProcessError:
+        return None
+    digest = hashlib.sha256(f'{tree} WEBOTS_CONTROLLER_URL={role}'.encode('utf-8')).hexdigest()
+    return f'{IMAGE_REPOSITORY}:{digest[:32]}'
+
+
+def webots_tag(world_file, world_content, untracked_directories=()):
+    '''Return a tag identifying the Webots image of the competition with a generated world and the files added to the
+    build context by the action, or None if it cannot be computed.'''
+
+    try:  # the tree of the competition repository covers the Dockerfile and its build context, with local changes
+        tree = subprocess.check_output(['git', 'rev-parse', 'HEAD^{tree}'],
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+        changes = subprocess.check_output(['git', 'diff', '--binary', 'HEAD'], stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return None
+    digest = hashlib.sha256(f'{tree}\n{world_file}\n{world_content}\n'.encode('utf-8') + changes)
+    for directory in untracked_directories:
+        _update_directory_digest(digest, directory)
+    return f'{WEBOTS_IMAGE_REPOSITORY}:{digest.hexdigest()[:32]}'
+
+
+def exists(tag):
+    return docker_engine.image_size(tag) is not None
+
+
+def touch(tag):
+    with _lock:
+        _used.add(tag)
+        index = _load_index()
+        index[tag] = time.time()
+        _save_index(index)
+
+
+def evict(max_size):
+    '''Remove the least recently used images until the size of the cached images is below max_size bytes.'''
+
+    with _lock:
+        index = _load_index()
+        sizes = {}
+        for tag in list(index):
+            size = docker_engine.image_size(tag)
+            if size is None:  # image removed outside of the cache
+                del index[tag]
+            else:
+                sizes[tag] = size
+        # shared layers are counted for each image, so the total size is an upper bound of the disk usage
+        total = sum(sizes.values())
+        for tag in sorted(sizes, key=lambda t: index[t]):
+            if total <= max_size:
+                break
+            if tag in _used:
+                continue
+            print(f'Evicting docker image {tag} from the cache')
+            docker_engine.remove_image(tag)
+            total -= sizes[tag]
+            del index[tag]
+        _save_index(index)
+
+
+def _update_directory_digest(digest, directory):
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        directories[:] = [d for d in directories if d != '__pycache__']
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(f'{os.path.relpath(path, directory)}\n'.encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+
+
+def _index_filename():
+    return os.path.join(cache.directory(), 'images.json')
+
+
+def _load_index():
+    filename = _index_filename()
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_index(index):
+    filename = _index_filename()
+    with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(filename + '.tmp', filename)
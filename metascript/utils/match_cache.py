@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from . import cache
+
+POLICIES = ['none', 'all', 'wins']
+# settings of the world section which don't change the outcome of a game
+ORCHESTRATION_KEYS = ['animation-compression', 'animation-delta', 'animation-sample-period', 'image-cache-size',
+                      'match-cache', 'match-cache-size', 'match-journal', 'parallel-games', 'parallel-runs', 'prefetch',
+                      'ranking-search', 'resource-sampling-period', 'timing-openmetrics', 'warm-webots']
+JOURNAL_FILE = 'journal.jsonl'
+
+
+def competition_digest(world_config, webots_image=None):
+    '''Return a digest of the side of the competition which may change the outcome of a game: the Webots image and the
+    settings of the world section.'''
+
+    settings = {key: value for key, value in world_config.items() if key not in ORCHESTRATION_KEYS}
+    # the tag of the Webots image covers the world, its resources and the controllers of the competition
+    if webots_image is None:  # the image is not tagged by its content, only the world and the Dockerfile are known
+        webots_image = f"{_file_digest(world_config['file'])} {_file_digest('Dockerfile')}"
+    return hashlib.sha256(json.dumps([webots_image, settings], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class MatchCache:
+    '''Persistent cache of the results and animations of games, keyed by everything which may change their outcome.
+
+    The policy is 'none' to always play the games, 'all' to reuse any cached result (for deterministic worlds) or
+    'wins' to only reuse the wins of the participant, so that a lost game is played again when it is retried.'''
+
+    def __init__(self, world_config, policy='none', webots_image=None):
+        if policy not in POLICIES:
+            print(f'::warning ::Unsupported match cache policy: {policy} (match-cache in webots.yml)')
+            policy = 'none'
+        self.policy = policy
+        self.competition = competition_digest(world_config, webots_image)
+        self.directory = cache.directory('matches') if policy != 'none' else None
+
+    def key(self, participant, opponent):  # None if the games are not cached
+        return self.game_key(participant, opponent) if self.policy != 'none' else None
+
+    def game_key(self, participant, opponent):  # None if a controller has no commit
+        if participant.commit is None or opponent.commit is None:
+            return None
+        text = json.dumps([participant.commit, opponent.commit, self.competition])
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def load(self, key, animation):
+        '''Return the cached performance of a game and restore its animation, or None if it has to be played.'''
+
+        if key is None:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, 'result.json')) as f:
+                performance = json.load(f)['performance']
+        except (OSError, ValueError, KeyError):
+            return None
+        if self.policy == 'wins' and performance != 1:
+            return None
+        os.makedirs(os.path.dirname(animation), exist_ok=True)
+        _link(os.path.join(path, 'animation.json'), animation)
+        os.utime(path)  # the least recently used games are evicted first
+        return performance
+
+    def store(self, key, performance, animation):
+        if key is None or not os.path.exists(animation):  # the game was not played
+            return
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path + '.tmp', exist_ok=True)
+        _link(animation, os.path.join(path + '.tmp', 'animation.json'))
+        with open(os.path.join(path + '.tmp', 'result.json'), 'w') as f:
+            json.dump({'performance': performance, 'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}, f)
+        os.replace(path + '.tmp', path)
+
+    def evict(self, max_size):
+        '''Remove the least recently used games until the size of the cache is below max_size bytes.'''
+
+        if self.directory is None:
+            return
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            shutil.rmtree(path)
+            total -= size
+
+
+class MatchJournal:
+    '''Append-only journal of the games decided in the job of a participant, with their animations.
+
+    If the job is interrupted, e.g. by the time limit or the loss of the runner, the next job of the participant replays
+    the journal, so that the games already decided with the same controllers and world are not played again and a long
+    ranking climb can be split across several jobs. The journal is removed once the job is complete.'''
+
+    def __init__(self, name=None):
+        self.directory = cache.directory('journals', name) if name else None
+        self.entries = {}  # by game key
+        self._lock = threading.Lock()
+        if self.directory is None or not os.path.exists(os.path.join(self.directory, JOURNAL_FILE)):
+            return
+        with open(os.path.join(self.directory, JOURNAL_FILE)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # the last line may be incomplete if the job was interrupted while writing it
+                    continue
+                self.entries[entry['key']] = entry
+        if self.entries:
+            print(f'Resuming the previous job from the {len(self.entries)} games of its journal')
+
+    def load(self, key, animation):
+        '''Return the performance of a game decided by a previous job and restore its animation, or None.'''
+
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None:
+            return None
+        if entry['animation'] is not None:
+            os.makedirs(os.path.dirname(animation), exist_ok=True)
+            _link(os.path.join(self.directory, entry['animation']), animation)
+        return entry['performance']
+
+    def append(self, key, participant, opponent, performance, animation):
+        if self.directory is None or key is None:
+            return
+        with self._lock:
+            artifact = None
+            if os.path.exists(animation):  # linked before the entry is written, which commits the game
+                artifact = f'{key}.animation.json'
+                _link(animation, os.path.join(self.directory, artifact))
+            entry = {'key': key, 'opponent': opponent.id, 'participant_commit': participant.commit,
+                     'opponent_commit': opponent.commit, 'performance': performance, 'animation': artifact,
+                     'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+            with open(os.path.join(self.directory, JOURNAL_FILE), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[key] = entry
+
+    def remove(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _file_digest(filename):
+    if not os.path.exists(filename):
+        return None
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(source, destination):  # the animations may be large, they are hard linked whenever possible
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:  # e.g. on different file systems
+        shutil.copyfile(source, destination)
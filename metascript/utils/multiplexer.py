@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import selectors
+
+READ_SIZE = 65536
+MAX_LINE_LENGTH = 65536  # longer lines are split, so that a stream without newlines cannot grow a buffer forever
+
+
+class LogMultiplexer:
+    '''Read the output of several processes without blocking on partial lines.
+
+    Each stream is read in non-blocking mode and its complete lines are passed to the handler of the stream. A muted
+    stream is still drained, so that the process writing it is never blocked, but its data is dropped undecoded.'''
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.streams = {}
+
+    def add(self, name, stream, handler):
+        os.set_blocking(stream.fileno(), False)
+        self.streams[name] = {'stream': stream, 'handler': handler, 'buffer': b'', 'muted': False}
+        self.selector.register(stream, selectors.EVENT_READ, name)
+
+    def mute(self, name):
+        self.streams[name]['muted'] = True
+        self.streams[name]['buffer'] = b''
+
+    def is_open(self, name):
+        return name in self.streams
+
+    def poll(self, timeout=None):
+        '''Wait at most timeout seconds for some output and pass it to the handlers.'''
+
+        for key, _ in self.selector.select(timeout):
+            name = key.data
+            if name not in self.streams:  # closed by a handler called for another stream
+                continue
+            stream = self.streams[name]
+            try:
+                data = os.read(stream['stream'].fileno(), READ_SIZE)
+            except BlockingIOError:
+                continue
+            if not data:  # end of file, the process has exited
+                self._flush(name)
+                self.remove(name)
+                continue
+            if stream['muted']:
+                continue
+            lines = (stream['buffer'] + data).split(b'\n')
+            stream['buffer'] = lines.pop()
+            for line in lines:
+                if stream['muted']:
+                    break
+                stream['handler'](line.decode('utf-8', 'replace').strip())
+            if len(stream['buffer']) > MAX_LINE_LENGTH:
+                self._flush(name)
+
+    def remove(self, name):
+        if name in self.streams:
+            self.selector.unregister(self.streams[name]['stream'])
+            del self.streams[name]
+
+    def close(self):
+        for name in list(self.streams):
+            self.remove(name)
+        self.selector.close()
+
+    def _flush(self, name):
+        stream = self.streams[name]
+        if stream['buffer'] and not stream['muted']:
+            stream['handler'](stream['buffer'].decode('utf-8', 'replace').strip())
+        stream['buffer'] = b''
+
+
+def dispatch(events, default=None):
+    '''Return a line handler calling the callback of the first event whose keyword is found in the line.'''
+
+    def handler(line):
+        for keyword, callback in events:
+            if keyword in line:
+                callback(line)
+                return
+        if default is not None:
+            default(line)
+
+    return handler
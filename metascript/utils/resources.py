@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import os
+import threading
+import time
+from . import docker_engine
+
+CGROUP_DIRECTORY = '/sys/fs/cgroup'
+# the cgroup of a container depends on the cgroup driver of docker: systemd or cgroupfs
+CONTAINER_CGROUPS = ['system.slice/docker-{id}*.scope', 'docker/{id}*']
+
+
+def available():  # cgroup v2 only
+    return os.path.exists(os.path.join(CGROUP_DIRECTORY, 'cgroup.controllers'))
+
+
+class ResourceSampler:
+    '''Sample the CPU and memory usage of the containers of a match from their cgroup v2 files.
+
+    The containers are found by the labels of their role as soon as they are started. For each role, the summary gives
+    the average and peak CPU usage in cores, the CPU time throttled by the limits and the average and peak memory.'''
+
+    def __init__(self, match, roles, period=1, persistent=[]):
+        self.match = match
+        self.period = period
+        self.persistent = persistent  # roles whose container outlives the game, their memory.peak is not relevant
+        self.cgroups = {role: None for role in roles}
+        self.exited = set()
+        self.samples = {role: [] for role in roles}  # time, CPU usage in microseconds, throttled time, memory
+        self.peaks = {role: 0 for role in roles}  # memory.peak, if supported by the kernel
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop sampling and return the summary of each role whose container was found.'''
+
+        self._stop.set()
+        self._thread.join()
+        summary = {}
+        for role, samples in self.samples.items():
+            if not samples:
+                continue
+            resources = {
+                'memory_average': round(sum(sample[3] for sample in samples) / len(samples)),
+                'memory_peak': max(self.peaks[role], max(sample[3] for sample in samples))
+            }
+            if len(samples) > 1:
+                intervals = list(zip(samples, samples[1:]))
+                duration = samples[-1][0] - samples[0][0]
+                resources['cpu_average'] = round((samples[-1][1] - samples[0][1]) / 1e6 / duration, 3)
+                resources['cpu_peak'] = round(max((b[1] - a[1]) / 1e6 / (b[0] - a[0]) for a, b in intervals), 3)
+                resources['cpu_throttled'] = round((samples[-1][2] - samples[0][2]) / 1e6, 3)
+            summary[role] = resources
+        return summary
+
+    def _run(self):
+        while True:
+            for role in self.cgroups:
+                self._sample(role)
+            if self._stop.wait(self.period):
+                break
+
+    def _sample(self, role):
+        if role in self.exited:
+            return
+        if self.cgroups[role] is None:
+            ids = docker_engine.container_ids(self.match.labels(role))
+            self.cgroups[role] = _find_cgroup(ids[0]) if ids else None
+            if self.cgroups[role] is None:
+                return
+        now = time.time()
+        try:
+            cpu_stat = dict(line.split() for line in _read(self.cgroups[role], 'cpu.stat').splitlines())
+            memory = int(_read(self.cgroups[role], 'memory.current'))
+            if role not in self.persistent and os.path.exists(os.path.join(self.cgroups[role], 'memory.peak')):
+                self.peaks[role] = int(_read(self.cgroups[role], 'memory.peak'))
+        except (OSError, ValueError):  # the container exited
+            self.exited.add(role)
+            return
+        self.samples[role].append((now, int(cpu_stat['usage_usec']), int(cpu_stat.get('throttled_usec', 0)), memory))
+
+
+def format_summary(role, resources):
+    text = f'{role}: memory {resources["memory_average"] / 1024 ** 2:.0f} MB on average, ' \
+        + f'{resources["memory_peak"] / 1024 ** 2:.0f} MB peak'
+    if 'cpu_average' in resources:
+        text += f', CPU {resources["cpu_average"]:.2f} cores on average, {resources["cpu_peak"]:.2f} peak, ' \
+            + f'{resources["cpu_throttled"]:.2f} s throttled'
+    return text
+
+
+def _find_cgroup(container_id):
+    for pattern in CONTAINER_CGROUPS:
+        paths = glob.glob(os.path.join(CGROUP_DIRECTORY, pattern.format(id=container_id)))
+        if paths:
+            return paths[0]
+    return None
+
+
+def _read(cgroup, filename):
+    with open(os.path.join(cgroup, filename)) as f:
+        return f.read()
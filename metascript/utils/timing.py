@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# Copyright 1996-2023 Cyberbotics Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+_lock = threading.Lock()
+_spans = []
+_origin = time.time()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    '''Time the enclosed block, the yielded attributes of the span can be completed inside the block.'''
+
+    start = time.time()
+    try:
+        yield attributes
+    finally:
+        record(name, start, time.time() - start, **attributes)
+
+
+def record(name, start, duration, **attributes):
+    with _lock:
+        _spans.append({'name': name, 'start': round(start - _origin, 3), 'duration': round(duration, 3), **attributes})
+
+
+def write_report(filename, openmetrics=False):
+    '''Write the spans recorded by the job and the total time spent in each phase as JSON.
+
+    If openmetrics is set, the totals are also written in the OpenMetrics text format, in a .txt file.'''
+
+    with _lock:
+        spans = sorted(_spans, key=lambda s: s['start'])
+    phases = {}
+    for s in spans:
+        phase = phases.setdefault(s['name'], {'count': 0, 'duration': 0})
+        phase['count'] += 1
+        phase['duration'] = round(phase['duration'] + s['duration'], 3)
+    report = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(_origin)),
+        'duration': round(time.time() - _origin, 3),
+        'phases': phases,
+        'spans': spans
+    }
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
+    if not openmetrics:
+        return
+    lines = ['# TYPE competition_phase_seconds summary', '# UNIT competition_phase_seconds seconds',
+             '# HELP competition_phase_seconds Time spent in each phase of the job.']
+    for name, phase in phases.items():
+        lines.append(f'competition_phase_seconds_count{{phase="{name}"}} {phase["count"]}')
+        lines.append(f'competition_phase_seconds_sum{{phase="{name}"}} {phase["duration"]}')
+    lines += ['# TYPE competition_job_seconds gauge', '# UNIT competition_job_seconds seconds',
+              f'competition_job_seconds {report["duration"]}', '# EOF']
+    with open(os.path.splitext(filename)[0] + '.txt', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
@@ -14,11 +14,110 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ThreadPoolExecutor
+import os
 import requests
+import requests.adapters
+import time
+import uuid
+from . import timing
 
+WEBOTS_CLOUD_URL = os.environ.get('WEBOTS_CLOUD_URL') or 'https://webots.cloud'  # may be a local stand-in server
+UPLOAD_JOBS = 4
+UPLOAD_TIMEOUT = (10, 300)  # connect and read timeouts in seconds
+UPLOAD_RETRIES = 3
+UPLOAD_BACKOFF = 2  # seconds, doubled after each retry
 
-def upload_file(repository, token, file, name):
-    data = {'path': file, 'repository': repository, 'token': token}
-    with open(file, 'rb') as f:
-        response = requests.post('https://webots.cloud/ajax/project/upload.php', files={name: f}, data=data)
-        print(response.text)
+
+class MultipartStream:
+    '''A multipart/form-data body read from the file as it is sent, instead of being built in memory.'''
+
+    def __init__(self, fields, name, file):
+        self.boundary = uuid.uuid4().hex
+        head = b''
+        for key, value in fields.items():
+            head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n').encode('utf-8')
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                 + f'filename="{os.path.basename(file)}"\r\nContent-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        self.parts = [head, None, f'\r\n--{self.boundary}--\r\n'.encode('utf-8')]
+        self.length = len(head) + os.path.getsize(file) + len(self.parts[2])
+        self.file = open(file, 'rb')
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):  # used by requests to set the Content-Length header
+        return self.length
+
+    def read(self, size=-1):
+        data = b''
+        while self.parts and (size < 0 or len(data) < size):
+            if self.parts[0] is None:  # the file part
+                chunk = self.file.read(-1 if size < 0 else size - len(data))
+                if chunk:
+                    data += chunk
+                    continue
+                self.parts.pop(0)
+            else:
+                n = len(self.parts[0]) if size < 0 else size - len(data)
+                data += self.parts[0][:n]
+                self.parts[0] = self.parts[0][n:]
+                if not self.parts[0]:
+                    self.parts.pop(0)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class Uploader:
+    '''Upload files to webots.cloud concurrently through a pool of connections, retrying on transient errors.'''
+
+    def __init__(self, repository, token, jobs=UPLOAD_JOBS, url=WEBOTS_CLOUD_URL):
+        self.repository = repository
+        self.token = token
+        self.jobs = jobs
+        self.url = f'{url}/ajax/project/upload.php'
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=jobs)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def upload(self, files):
+        '''Upload a list of (path, name, filename) tuples, return the list of paths which failed to upload.'''
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(lambda file: self._upload(*file), files))
+        failures = [path for path, result in zip([file[0] for file in files], results) if not result]
+        size = sum(os.path.getsize(file[2]) for file in files)
+        print(f'Uploaded {len(files) - len(failures)}/{len(files)} files ({size / 1024 ** 2:.1f} MB) to webots.cloud '
+              + f'in {time.time() - start:.1f} seconds')
+        for path in failures:
+            print(f'::error ::Failed to upload {path} to webots.cloud')
+        return failures
+
+    def _upload(self, path, name, filename):
+        with timing.span('upload', path=path, size=os.path.getsize(filename)) as span:
+            span['success'] = self._post(path, name, filename, span)
+            return span['success']
+
+    def _post(self, path, name, filename, span):
+        data = {'path': path, 'repository': self.repository, 'token': self.token}
+        for attempt in range(UPLOAD_RETRIES + 1):
+            span['attempts'] = attempt + 1
+            if attempt > 0:
+                time.sleep(UPLOAD_BACKOFF * 2 ** (attempt - 1))
+            body = MultipartStream(data, name, filename)
+            try:
+                response = self.session.post(self.url, data=body, headers={'Content-Type': body.content_type},
+                                             timeout=UPLOAD_TIMEOUT)
+            except requests.RequestException as e:
+                print(f'Upload of {path} failed (attempt {attempt + 1}): {e}')
+                continue
+            finally:
+                body.close()
+            if response.status_code >= 500 or response.status_code == 429:  # the server may recover
+                print(f'Upload of {path} failed (attempt {attempt + 1}): HTTP {response.status_code}')
+                continue
+            print(f'{path}: {response.text}')
+            return response.ok
+        return False